@@ -1,18 +1,51 @@
 # Modern Data Lake Architecture with AWS Services
 # This is the MOST EFFICIENT approach for production workloads
 
+import hashlib
+import io
 import json
+import math
 import os
-import boto3
-import pandas as pd
-from datetime import datetime, timedelta
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Any, Optional
 import requests
-import awswrangler as wr  # AWS Data Wrangler for optimized S3/Athena operations
+
+# boto3, numpy, pandas and awswrangler are imported inside the functions that use
+# them, so a cold start only pays for what the run needs; a run that finds no
+# new jobs never loads awswrangler.
+
+
+def parse_search_queries(value, default_country, default_phrase):
+    """Parse SEARCH_QUERIES ("ca:data engineer;gb:data engineer") into (country, phrase) pairs."""
+    queries = []
+    for item in (value or "").split(";"):
+        if not item.strip():
+            continue
+        country, sep, phrase = item.partition(":")
+        if not sep:
+            country, phrase = default_country, country
+        query = (country.strip().lower(), phrase.strip())
+        if query not in queries:
+            queries.append(query)
+    return queries or [(default_country, default_phrase)]
+
+
+def query_key(query):
+    """Stable identifier for a (country, phrase) query, used in state and reporting."""
+    return f"{query[0]}:{query[1]}"
 
 
 def get_config():
     """Load pipeline configuration from environment variables."""
+    country = os.getenv("ADZUNA_COUNTRY", "ca")
+    search_phrase = os.getenv("SEARCH_PHRASE", "data engineer")
     return {
         "adzuna_app_id": os.getenv("ADZUNA_APP_ID"),
         "adzuna_app_key": os.getenv("ADZUNA_APP_KEY"),
@@ -21,189 +54,961 @@ def get_config():
         "dynamodb_state_table": os.getenv("DYNAMODB_STATE_TABLE", "adzuna-pipeline-state"),
         "glue_database": os.getenv("GLUE_DATABASE", "job_data_lake"),
         "glue_table": os.getenv("GLUE_TABLE", "adzuna_jobs"),
-        "search_phrase": os.getenv("SEARCH_PHRASE", "data engineer"),
+        "search_phrase": search_phrase,
+        "search_queries": parse_search_queries(os.getenv("SEARCH_QUERIES"), country, search_phrase),
+        "query_concurrency": int(os.getenv("QUERY_CONCURRENCY", "4")),
         "overlap_hours": int(os.getenv("OVERLAP_HOURS", "12")),
         "batch_size": int(os.getenv("BATCH_SIZE", "1000")),
+        "fetch_concurrency": int(os.getenv("FETCH_CONCURRENCY", "4")),
+        "rate_limit_per_minute": float(os.getenv("ADZUNA_RATE_LIMIT_PER_MINUTE", "25")),
+        "rate_limit_burst": int(os.getenv("ADZUNA_RATE_LIMIT_BURST", "4")),
+        "max_attempts": int(os.getenv("ADZUNA_MAX_ATTEMPTS", "5")),
+        "parquet_flush_rows": int(os.getenv("PARQUET_FLUSH_ROWS", "100000")),
+        "parquet_flush_mb": int(os.getenv("PARQUET_FLUSH_MB", "128")),
+        "checkpoint_reserve_ms": int(os.getenv("CHECKPOINT_RESERVE_MS", "60000")),
+        "seen_index_key": os.getenv("SEEN_INDEX_KEY", "pipeline-state/adzuna-jobs/seen_job_ids.npz"),
+        "seen_index_retention_days": int(os.getenv("SEEN_INDEX_RETENTION_DAYS", "7")),
     }
 
 
-def get_state(dynamodb, table_name):
-    """Get the last extraction state from DynamoDB."""
+class AdaptiveRateLimiter:
+    """Token bucket shared by every Adzuna request made from this container.
+
+    The refill rate is halved when the API throttles us and recovers gradually on
+    success, so the extractor settles just under the quota instead of bouncing
+    between 429s and idle time.
+    """
+
+    def __init__(self, max_rate, burst=1, min_rate=0.05):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.counters = {"succeeded": 0, "throttled": 0, "retried": 0, "failed": 0}
+
+    def acquire(self, stop=None):
+        """Block until a token is available and no Retry-After pause is active.
+
+        Returns False without taking a token if ``stop`` is set while waiting.
+        """
+        while True:
+            if stop is not None and stop.is_set():
+                return False
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+            if stop is not None:
+                stop.wait(wait)
+            else:
+                time.sleep(wait)
+
+    def record(self, outcome):
+        with self.lock:
+            self.counters[outcome] += 1
+            if outcome == "succeeded":
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def throttle(self, delay):
+        """Back off every caller for ``delay`` seconds and slow the refill rate."""
+        with self.lock:
+            self.counters["throttled"] += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+def parse_retry_after(response):
+    """Return the Retry-After delay in seconds, or None if absent or malformed."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
     try:
-        table = dynamodb.Table(table_name)
-        response = table.get_item(Key={"state_id": "adzuna_pipeline_state"}, ConsistentRead=True)
-        return response.get("Item", {
-            "state_id": "adzuna_pipeline_state",
-            "last_extraction_time": (datetime.now() - timedelta(days=7)).isoformat(),
-            "total_jobs_extracted": 0,
-            "version": 0,
-            "created_at": datetime.now().isoformat()
-        })
-    except Exception as e:
-        print(f"Error reading state: {e}")
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class FetchStopped(Exception):
+    """Raised for a request that was abandoned because the run is stopping."""
+
+
+class RateLimitedAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter that paces requests through a limiter and retries 429/5xx responses.
+
+    Requests still waiting for the limiter when ``stop`` is set raise ``FetchStopped``.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, limiter, max_attempts=5, backoff_base=1.0, backoff_max=60.0, stop=None, **kwargs):
+        self.limiter = limiter
+        self.stop = stop
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            if not self.limiter.acquire(self.stop):
+                raise FetchStopped(f"Stopped before requesting {request.path_url.split('?')[0]}")
+            response = super().send(request, **kwargs)
+            if response.status_code not in self.RETRY_STATUSES:
+                self.limiter.record("succeeded" if response.ok else "failed")
+                return response
+            if attempt == self.max_attempts:
+                self.limiter.record("failed")
+                return response
+            delay = parse_retry_after(response)
+            if delay is None:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                delay += random.uniform(0, delay / 2)
+            print(f"Retrying {request.path_url.split('?')[0]} after {response.status_code} in {delay:.1f}s")
+            response.close()
+            self.limiter.record("retried")
+            if response.status_code == 429:
+                self.limiter.throttle(delay)
+            elif self.stop is not None:
+                self.stop.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter(config):
+    """Return the container-wide rate limiter, creating it on first use."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = AdaptiveRateLimiter(
+            max_rate=config["rate_limit_per_minute"] / 60,
+            burst=config["rate_limit_burst"]
+        )
+    return _rate_limiter
+
+
+# boto3 clients and resources built once per container and reused by warm invocations
+_aws_registry = {}
+_aws_timings = {}
+_aws_lock = threading.Lock()
+
+
+def _aws_lookup(kind, service, factory):
+    """Return the registered boto3 object for a service, building it on first use."""
+    name = f"{kind}:{service}"
+    start = time.perf_counter()
+    with _aws_lock:
+        created = name not in _aws_registry
+        if created:
+            _aws_registry[name] = factory(service)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        stats = _aws_timings.setdefault(name, {"cold_init_ms": 0.0, "warm_hits": 0, "warm_ms": 0.0})
+        if created:
+            stats["cold_init_ms"] = round(elapsed_ms, 3)
+        else:
+            stats["warm_hits"] += 1
+            stats["warm_ms"] += elapsed_ms
+        return _aws_registry[name]
+
+
+def get_aws_client(service):
+    """Shared boto3 client for a service."""
+    import boto3
+    return _aws_lookup("client", service, boto3.client)
+
+
+def get_aws_resource(service):
+    """Shared boto3 resource for a service."""
+    import boto3
+    return _aws_lookup("resource", service, boto3.resource)
+
+
+def aws_init_timings():
+    """Cold construction time and warm lookup cost of every registered client."""
+    with _aws_lock:
         return {
-            "state_id": "adzuna_pipeline_state",
-            "last_extraction_time": (datetime.now() - timedelta(days=7)).isoformat(),
-            "total_jobs_extracted": 0,
-            "version": 0,
-            "created_at": datetime.now().isoformat()
+            name: {
+                "cold_init_ms": stats["cold_init_ms"],
+                "warm_hits": stats["warm_hits"],
+                "warm_avg_ms": round(stats["warm_ms"] / stats["warm_hits"], 3) if stats["warm_hits"] else 0.0
+            }
+            for name, stats in _aws_timings.items()
         }
 
 
-def update_state(dynamodb, table_name, updates):
-    """Update the extraction state in DynamoDB atomically."""
-    table = dynamodb.Table(table_name)
-    current_state = get_state(dynamodb, table_name)
-    current_version = current_state.get("version", 0)
-    try:
-        table.put_item(
-            Item={
-                "state_id": "adzuna_pipeline_state",
-                "version": current_version + 1,
-                "updated_at": datetime.now().isoformat(),
-                **updates
-            },
-            ConditionExpression="attribute_not_exists(version) OR version = :current_version",
-            ExpressionAttributeValues={":current_version": current_version}
-        )
-        return True
-    except Exception as e:
-        print(f"Error updating state: {e}")
+STATE_ID = "adzuna_pipeline_state"
+
+
+def default_state():
+    """State used on the very first run, or when the state item cannot be read."""
+    return {
+        "state_id": STATE_ID,
+        "last_extraction_time": (datetime.now() - timedelta(days=7)).isoformat(),
+        "total_jobs_extracted": 0,
+        "version": 0,
+        "created_at": datetime.now().isoformat()
+    }
+
+
+class PipelineStateManager:
+    """Reads the pipeline state item once and writes it back with one conditional put.
+
+    The version loaded by ``load`` is the one the optimistic lock compares
+    against. On a conflict the item is reloaded and the change re-applied on
+    top of it, up to ``max_attempts`` times.
+    """
+
+    def __init__(self, dynamodb, table_name, max_attempts=3):
+        self.table = dynamodb.Table(table_name)
+        self.max_attempts = max_attempts
+        self.item = None
+        self.version = 0
+        self.metrics = {"reads": 0, "read_ms": 0.0, "writes": 0, "write_ms": 0.0, "conflicts": 0}
+
+    def load(self):
+        """Fetch the state item with a consistent read and cache it with its version."""
+        started = time.perf_counter()
+        try:
+            response = self.table.get_item(Key={"state_id": STATE_ID}, ConsistentRead=True)
+            self.item = response.get("Item") or default_state()
+        except Exception as e:
+            print(f"Error reading state: {e}")
+            self.item = default_state()
+        finally:
+            self.metrics["reads"] += 1
+            self.metrics["read_ms"] += round((time.perf_counter() - started) * 1000, 2)
+        self.version = int(self.item.get("version", 0))
+        return self.item
+
+    def save(self, updates=None, increments=None, merges=None):
+        """Apply field ``updates``, numeric ``increments`` and map ``merges`` and write the item.
+
+        Increments and merges are re-applied to the fresh item after a conflict, so
+        concurrent extractors never lose each other's counts or watermarks.
+        """
+        if self.item is None:
+            self.load()
+        for _ in range(self.max_attempts):
+            item = {**self.item, **(updates or {})}
+            for field, delta in (increments or {}).items():
+                item[field] = item.get(field, 0) + delta
+            for field, values in (merges or {}).items():
+                item[field] = {**item.get(field, {}), **values}
+            item["version"] = self.version + 1
+            item["updated_at"] = datetime.now().isoformat()
+            started = time.perf_counter()
+            try:
+                self.table.put_item(
+                    Item=item,
+                    ConditionExpression="attribute_not_exists(version) OR version = :current_version",
+                    ExpressionAttributeValues={":current_version": self.version}
+                )
+                self.item = item
+                self.version = item["version"]
+                return True
+            except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+                print(f"State version {self.version} is stale, reloading")
+                self.metrics["conflicts"] += 1
+                self.load()
+            except Exception as e:
+                print(f"Error updating state: {e}")
+                return False
+            finally:
+                self.metrics["writes"] += 1
+                self.metrics["write_ms"] += round((time.perf_counter() - started) * 1000, 2)
         return False
 
 
-def fetch_jobs_from_adzuna(config, extraction_window):
-    """Generator that yields DataFrames of jobs from Adzuna API in batches."""
+RESULTS_PER_PAGE = 50
+# Overridable so benchmarks can point the extractor at a local fake server
+ADZUNA_API_URL = os.getenv("ADZUNA_API_URL", "https://api.adzuna.com/v1/api/jobs")
+
+
+def fetch_page(session, country, params, page):
+    """Fetch a single Adzuna search page, returning its JSON body or None on an API error."""
+    resp = session.get(
+        f"{ADZUNA_API_URL}/{country}/search/{page}",
+        params=params,
+        timeout=30
+    )
+    if resp.status_code != 200:
+        print(f"API error on {country} page {page}: {resp.status_code}")
+        return None
+    return resp.json()
+
+
+def fetch_jobs_from_adzuna(config, query, extraction_window, stats=None, start_page=1, stop=None):
+    """Generator that yields ``(through_page, jobs_df)`` batches of in-window jobs from Adzuna API.
+
+    ``through_page`` is the last page whose rows are all contained in this or an
+    earlier batch, i.e. the page a resumed run can safely continue after.
+    The first page is fetched alone; its ``count`` caps paging at the last real
+    page. After that up to ``fetch_concurrency`` pages are kept in flight, but only
+    up to the page where the window start is expected from the posting rate seen
+    so far; past that estimate pages are fetched one at a time. Pages are consumed
+    strictly in order so batches are identical to a sequential walk. Results are
+    sorted newest first, so no page is requested after one that reaches back past
+    the window start. Pages that were requested ahead but never consumed are
+    counted as ``pages_speculative``. Paging counters are written to ``stats``.
+    Once the ``stop`` event is set no further page is requested or consumed, and
+    rows not yet yielded are dropped; they are fetched again by the resumed run.
+    """
+    if stats is None:
+        stats = {}
+    stats.update({
+        "start_page": start_page,
+        "pages_fetched": start_page - 1,
+        "pages_skipped": 0,
+        "pages_speculative": 0,
+        "rows_outside_window": 0,
+        "stopped_at_watermark": False,
+        "error": None
+    })
+    country, phrase = query
+    # Adzuna "created" values share one fixed-width UTC format, so they compare correctly as strings
+    window_start = extraction_window["start_time"].strftime(CREATED_FORMAT)
+    window_end = extraction_window["end_time"].strftime(CREATED_FORMAT)
+    concurrency = max(1, config["fetch_concurrency"])
     session = requests.Session()
-    adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=3)
+    adapter = RateLimitedAdapter(
+        get_rate_limiter(config),
+        max_attempts=config["max_attempts"],
+        pool_connections=10,
+        pool_maxsize=max(20, concurrency),
+        # Connection errors only; status retries are handled by the adapter itself
+        max_retries=requests.adapters.Retry(total=3, respect_retry_after_header=False),
+        stop=stop
+    )
     session.mount('http://', adapter)
     session.mount('https://', adapter)
-    all_jobs = []
-    page = 1
-    while True:
-        days_old = (datetime.now() - extraction_window['start_time']).days + 1
-        params = {
-            "app_id": config["adzuna_app_id"],
-            "app_key": config["adzuna_app_key"],
-            "results_per_page": 50,
-            "what_phrase": config["search_phrase"],
-            "max_days_old": min(days_old, 30),
-            "sort_by": "date"
-        }
+    days_old = (datetime.now() - extraction_window['start_time']).days + 1
+    params = {
+        "app_id": config["adzuna_app_id"],
+        "app_key": config["adzuna_app_key"],
+        "results_per_page": RESULTS_PER_PAGE,
+        "what_phrase": phrase,
+        "max_days_old": min(days_old, 30),
+        "sort_by": "date"
+    }
+    builder = JobColumnBuilder(config["batch_size"], country=country)
+
+    def stopped():
+        return stop is not None and stop.is_set()
+
+    next_page = start_page
+    # Unknown until the first response reports the total result count
+    last_page = None
+    # Page expected to reach back to the window start, and the newest job seen
+    horizon = None
+    newest = None
+
+    def may_request(page):
+        if last_page is None:
+            return not in_flight
+        if page > last_page:
+            return False
+        return horizon is None or page <= horizon or not in_flight
+
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
         try:
-            resp = session.get(
-                f"https://api.adzuna.com/v1/api/jobs/ca/search/{page}",
-                params=params,
-                timeout=30
-            )
-            if resp.status_code != 200:
-                print(f"API error on page {page}: {resp.status_code}")
-                break
-            jobs_batch = resp.json().get("results", [])
-            if not jobs_batch:
-                break
-            all_jobs.extend(jobs_batch)
-            if len(all_jobs) >= config["batch_size"]:
-                yield parse_jobs_batch(all_jobs[:config["batch_size"]])
-                all_jobs = all_jobs[config["batch_size"]:]
-            page += 1
-            if len(jobs_batch) < 50:
-                break
+            while not stopped():
+                while len(in_flight) < concurrency and may_request(next_page) and not stopped():
+                    in_flight.append((next_page, executor.submit(fetch_page, session, country, params, next_page)))
+                    next_page += 1
+                if not in_flight:
+                    break
+                page, future = in_flight.popleft()
+                try:
+                    body = future.result()
+                except Exception as e:
+                    if stopped():
+                        break
+                    print(f"Error fetching {country} page {page}: {e}")
+                    stats["error"] = str(e)
+                    break
+                if stopped():
+                    break
+                if body is None:
+                    stats["error"] = f"API error on page {page}"
+                    break
+                jobs_batch = body.get("results", [])
+                if not jobs_batch:
+                    break
+                stats["pages_fetched"] = page
+                last_page = math.ceil(body.get("count", 0) / RESULTS_PER_PAGE)
+                created = [job.get("created") or "" for job in jobs_batch]
+                reached_window_start = min(created) < window_start
+                if reached_window_start:
+                    stats["stopped_at_watermark"] = True
+                if max(created) < window_start:
+                    stats["rows_outside_window"] += len(jobs_batch)
+                    break
+                in_window = [job for job, ts in zip(jobs_batch, created) if window_start <= ts <= window_end]
+                stats["rows_outside_window"] += len(jobs_batch) - len(in_window)
+                taken = 0
+                while taken < len(in_window):
+                    taken += builder.extend(in_window, taken)
+                    if builder.full:
+                        yield (page if taken == len(in_window) else page - 1), builder.flush()
+                # Later pages are older still, so they hold no rows in the window
+                if reached_window_start or len(jobs_batch) < RESULTS_PER_PAGE:
+                    break
+                oldest = datetime.strptime(min(created), CREATED_FORMAT)
+                newest = newest or datetime.strptime(max(created), CREATED_FORMAT)
+                seconds_per_page = (newest - oldest).total_seconds() / (page - start_page + 1)
+                if seconds_per_page > 0:
+                    remaining = (oldest - extraction_window["start_time"]).total_seconds()
+                    horizon = page + max(1, math.ceil(remaining / seconds_per_page))
+        finally:
+            # Pages requested ahead are dropped; those already sent still cost a request
+            requested_through = next_page - 1
+            for in_flight_page, future in reversed(in_flight):
+                if future.cancel() and in_flight_page == requested_through:
+                    requested_through -= 1
+                elif not future.cancelled():
+                    stats["pages_speculative"] += 1
+            if stats["stopped_at_watermark"] and last_page is not None:
+                stats["pages_skipped"] = max(0, last_page - requested_through)
+    if len(builder) and not stopped():
+        yield stats["pages_fetched"], builder.flush()
+
+
+def fetch_jobs_for_queries(config, plans, stats, should_stop=None):
+    """Run one fetcher per query plan in parallel and yield ``(query, through_page, jobs_df)``.
+
+    Each plan holds a ``query``, its extraction ``window`` and the ``start_page``
+    to resume from. Once a query has nothing more to fetch, ``(query, None, None)``
+    is yielded. All fetchers share the container-wide rate limiter, and per-query
+    paging counters are written to ``stats`` keyed by ``query_key``. The
+    generator returns early when ``should_stop()`` becomes true while waiting;
+    stopping, or closing the generator, makes every fetcher abandon its
+    remaining pages so the pool shuts down without further API calls.
+    """
+    batches = queue.Queue(maxsize=2 * max(1, len(plans)))
+    done = object()
+    stop = threading.Event()
+
+    def run(plan):
+        query = plan["query"]
+        query_stats = stats.setdefault(query_key(query), {})
+        try:
+            if stop.is_set():
+                return
+            for through_page, jobs_df in fetch_jobs_from_adzuna(
+                config, query, plan["window"], query_stats, plan["start_page"], stop
+            ):
+                if stop.is_set():
+                    break
+                batches.put((query, through_page, jobs_df))
         except Exception as e:
-            print(f"Error fetching page {page}: {e}")
-            break
-    if all_jobs:
-        yield parse_jobs_batch(all_jobs)
+            print(f"Error fetching query {query_key(query)}: {e}")
+            query_stats["error"] = str(e)
+        finally:
+            batches.put((query, None, done))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(config["query_concurrency"], len(plans)))) as executor:
+        for plan in plans:
+            executor.submit(run, plan)
+        remaining = len(plans)
+        try:
+            while remaining:
+                try:
+                    query, through_page, jobs_df = batches.get(timeout=1)
+                except queue.Empty:
+                    if should_stop is not None and should_stop():
+                        return
+                    continue
+                if jobs_df is done:
+                    remaining -= 1
+                    yield query, None, None
+                else:
+                    yield query, through_page, jobs_df
+        finally:
+            # If the consumer stops early, unblock the fetchers so the pool can shut down
+            stop.set()
+            while remaining:
+                if batches.get()[2] is done:
+                    remaining -= 1
+
+
+JOB_COLUMNS = (
+    "job_id",
+    "job_title",
+    "job_location",
+    "job_company",
+    "job_category",
+    "job_description",
+    "job_url",
+    "job_created",
+)
+CATEGORY_COLUMNS = ("job_location", "job_company", "job_category", "job_country")
+# Adzuna always returns UTC timestamps such as 2024-01-15T10:23:45Z
+CREATED_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class JobColumnBuilder:
+    """Single-pass columnar buffer that turns raw Adzuna job dicts into a DataFrame."""
+
+    def __init__(self, capacity, country=None):
+        self.capacity = max(1, capacity)
+        self.country = country
+        self._country_dtype = None
+        self._allocate()
+
+    def _allocate(self):
+        self.columns = {name: [None] * self.capacity for name in JOB_COLUMNS}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def full(self):
+        return self.size >= self.capacity
+
+    def extend(self, jobs, start=0):
+        """Copy raw jobs from ``jobs[start:]`` into the buffers until full; return the count taken."""
+        count = min(self.capacity - self.size, len(jobs) - start)
+        ids, titles, locations, companies, categories, descriptions, urls, created = (
+            self.columns[name] for name in JOB_COLUMNS
+        )
+        i = self.size
+        for job in jobs[start:start + count]:
+            get = job.get
+            ids[i] = get("id")
+            titles[i] = get("title")
+            locations[i] = (get("location") or {}).get("display_name")
+            companies[i] = (get("company") or {}).get("display_name")
+            categories[i] = (get("category") or {}).get("label")
+            descriptions[i] = get("description")
+            urls[i] = get("redirect_url")
+            created[i] = get("created")
+            i += 1
+        self.size = i
+        return count
+
+    def flush(self):
+        """Return the buffered rows as a typed DataFrame and reset the buffers."""
+        import pandas as pd
+        if not self.size:
+            return pd.DataFrame()
+        size = self.size
+        columns = {name: values[:size] for name, values in self.columns.items()}
+        self._allocate()
+        for col in CATEGORY_COLUMNS:
+            if col in columns:
+                columns[col] = pd.Categorical(columns[col])
+        if self.country:
+            import numpy as np
+            # A single category: build the codes directly instead of factorizing a repeated string
+            if self._country_dtype is None:
+                self._country_dtype = pd.CategoricalDtype([self.country])
+            columns["job_country"] = pd.Categorical.from_codes(np.zeros(size, dtype=np.int8), dtype=self._country_dtype)
+        columns["job_created"] = pd.to_datetime(columns["job_created"], format="ISO8601", errors="coerce")
+        df = pd.DataFrame(columns)
+        return df.dropna(subset=["job_id", "job_title", "job_created"])
 
 
 def parse_jobs_batch(raw_jobs):
     """Convert a list of raw job dicts to a DataFrame, cleaning and optimizing types."""
-    if not raw_jobs:
-        return pd.DataFrame()
-    jobs_data = {
-        "job_id": [job.get("id") for job in raw_jobs],
-        "job_title": [job.get("title") for job in raw_jobs],
-        "job_location": [job.get("location", {}).get("display_name") for job in raw_jobs],
-        "job_company": [job.get("company", {}).get("display_name") for job in raw_jobs],
-        "job_category": [job.get("category", {}).get("label") for job in raw_jobs],
-        "job_description": [job.get("description") for job in raw_jobs],
-        "job_url": [job.get("redirect_url") for job in raw_jobs],
-        "job_created": [job.get("created") for job in raw_jobs]
-    }
-    df = pd.DataFrame(jobs_data)
-    df["job_created"] = pd.to_datetime(df["job_created"])
-    df = df.dropna(subset=["job_id", "job_title", "job_created"])
-    # Optimize types
-    for col in ["job_location", "job_company", "job_category"]:
-        if col in df.columns:
-            df[col] = df[col].astype("category")
-    return df
-
-
-def save_jobs_to_s3_parquet(config, jobs_df):
-    """Save jobs DataFrame to S3 as Parquet, partitioned by date, deduplicated by job_id."""
+    builder = JobColumnBuilder(len(raw_jobs))
+    builder.extend(raw_jobs)
+    return builder.flush()
+
+
+def job_id_keys(job_ids):
+    """Map job ids to int64 keys: numeric Adzuna ids exactly, anything else by 64-bit hash."""
+    def key(job_id):
+        job_id = str(job_id)
+        if job_id.isdigit() and len(job_id) < 19:
+            return int(job_id)
+        return int.from_bytes(hashlib.blake2b(job_id.encode(), digest_size=8).digest(), "big", signed=True)
+    import numpy as np
+    return np.fromiter((key(job_id) for job_id in job_ids), dtype=np.int64, count=len(job_ids))
+
+
+class SeenJobIndex:
+    """Sorted int64 index of already-ingested job ids, persisted to S3 between runs.
+
+    Ids are bucketed by the day the job was created; buckets older than the
+    retention window are dropped on save so the index stays bounded. Numeric ids
+    are stored exactly, so only the hashed fallback can produce false positives.
+    The index is read on the first batch that needs it and written back only
+    when new ids were added. Ids passed by ``filter_new`` are held in memory
+    until ``commit`` confirms their rows were written; ``release`` forgets the
+    ids of a failed write so a later run ingests them again.
+    """
+
+    def __init__(self, s3_client, bucket, key, retention_days):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.retention_days = retention_days
+        self.buckets = {}
+        self.known = None
+        self.dirty = False
+        self.stats = {"checked": 0, "hits": 0, "hashed_ids": 0, "indexed_ids": 0}
+
+    def load(self):
+        """Load the persisted index; a missing or unreadable object starts an empty one."""
+        import numpy as np
+        self.known = np.empty(0, dtype=np.int64)
+        try:
+            body = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)["Body"].read()
+            with np.load(io.BytesIO(body), allow_pickle=False) as archive:
+                self.buckets = {day: archive[day] for day in archive.files}
+        except self.s3_client.exceptions.NoSuchKey:
+            self.buckets = {}
+        except Exception as e:
+            print(f"Error reading seen-job index, starting empty: {e}")
+            self.buckets = {}
+        if self.buckets:
+            self.known = np.unique(np.concatenate(list(self.buckets.values())))
+        self.stats["indexed_ids"] = len(self.known)
+        return self
+
+    def filter_new(self, jobs_df):
+        """Return only rows whose job_id has not been ingested before, and index them."""
+        if jobs_df.empty:
+            return jobs_df
+        import numpy as np
+        if self.known is None:
+            self.load()
+        jobs_df = jobs_df.drop_duplicates(subset=["job_id"])
+        keys = job_id_keys(jobs_df["job_id"].tolist())
+        seen = np.isin(keys, self.known, assume_unique=True)
+        self.stats["checked"] += len(keys)
+        self.stats["hits"] += int(seen.sum())
+        self.stats["hashed_ids"] += int((~jobs_df["job_id"].astype(str).str.isdigit()).sum())
+        self.known = np.union1d(self.known, keys[~seen])
+        return jobs_df[~seen]
+
+    def commit(self, jobs_df):
+        """Add the ids of rows that were durably written to the persisted buckets."""
+        if jobs_df.empty:
+            return
+        import numpy as np
+        keys = job_id_keys(jobs_df["job_id"].tolist())
+        days = jobs_df["job_created"].dt.strftime("%Y-%m-%d").to_numpy()
+        for day in np.unique(days):
+            day_keys = np.unique(keys[days == day])
+            self.buckets[day] = np.union1d(self.buckets.get(day, np.empty(0, dtype=np.int64)), day_keys)
+        self.dirty = True
+
+    def release(self, jobs_df):
+        """Forget the ids of rows whose write failed, so they are not filtered out again."""
+        if jobs_df.empty or self.known is None:
+            return
+        import numpy as np
+        keys = job_id_keys(jobs_df["job_id"].tolist())
+        self.known = np.setdiff1d(self.known, keys, assume_unique=False)
+
+    def save(self):
+        """Expire old buckets and write the index back to S3 if new ids were added."""
+        if not self.dirty:
+            return
+        import numpy as np
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+        self.buckets = {day: keys for day, keys in self.buckets.items() if day >= cutoff}
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **self.buckets)
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=buffer.getvalue())
+        self.dirty = False
+        self.stats["indexed_ids"] = sum(len(keys) for keys in self.buckets.values())
+
+    def report(self):
+        checked = self.stats["checked"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / checked, 4) if checked else 0.0,
+        }
+
+
+def save_jobs_to_s3_parquet(config, jobs_df, update_catalog=True, extraction_time=None):
+    """Save jobs DataFrame to S3 as Parquet, partitioned by extraction date."""
     if jobs_df.empty:
         return {"new_jobs": 0, "files_written": 0}
-    jobs_df["extraction_date"] = datetime.now().date()
-    jobs_df["extraction_timestamp"] = datetime.now()
+    extraction_time = extraction_time or datetime.now()
+    jobs_df["extraction_date"] = extraction_time.date()
+    jobs_df["extraction_timestamp"] = extraction_time
     s3_path = f"s3://{config['s3_bucket']}/{config['s3_processed_prefix']}/"
+    catalog_args = {"database": config["glue_database"], "table": config["glue_table"]} if update_catalog else {}
     try:
+        import awswrangler as wr  # AWS Data Wrangler for optimized S3/Athena operations
         result = wr.s3.to_parquet(
             df=jobs_df,
             path=s3_path,
             dataset=True,
             partition_cols=["extraction_date"],
             mode="append",
-            database=config["glue_database"],
-            table=config["glue_table"],
-            merge_column="job_id",
             compression="snappy",
-            max_rows_by_file=50000,
-            sanitize_columns=True
+            max_rows_by_file=config["parquet_flush_rows"],
+            sanitize_columns=True,
+            **catalog_args
         )
         return {
             "new_jobs": len(jobs_df),
             "files_written": len(result["paths"]),
-            "table_updated": True
+            "table_updated": update_catalog,
+            "partitions_values": result["partitions_values"]
         }
     except Exception as e:
         print(f"Error saving to data lake: {e}")
         return {"new_jobs": 0, "files_written": 0, "error": str(e)}
 
 
+class ParquetBatchWriter:
+    """Buffers job batches for a whole run and writes them as a few large Parquet files.
+
+    The first successful flush goes through the Glue catalog so the table and
+    partition exist; later flushes only write files, and ``close`` registers any
+    partitions they added with a single catalog call. ``on_flush(jobs_df, ok)``
+    is called after every flush with the rows it tried to write.
+    """
+
+    def __init__(self, config, on_flush=None):
+        self.config = config
+        self.on_flush = on_flush
+        self.extraction_time = datetime.now()
+        self.flush_bytes = config["parquet_flush_mb"] * 1024 * 1024
+        self.pending = []
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        self.catalog_ready = False
+        self.registered_partitions = set()
+        self.unregistered_partitions = {}
+        self.stats = {"new_jobs": 0, "files_written": 0, "flushes": 0, "catalog_updates": 0, "errors": []}
+
+    def add(self, jobs_df):
+        """Buffer a batch, flushing once the row or size threshold is reached."""
+        if jobs_df.empty:
+            return
+        self.pending.append(jobs_df)
+        self.pending_rows += len(jobs_df)
+        self.pending_bytes += int(jobs_df.memory_usage(deep=True).sum())
+        if self.pending_rows >= self.config["parquet_flush_rows"] or self.pending_bytes >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far as one dataset append."""
+        if not self.pending:
+            return
+        import pandas as pd
+        jobs_df = pd.concat(self.pending, ignore_index=True)
+        # concat falls back to object dtype when batches have different categories
+        for col in CATEGORY_COLUMNS:
+            if col in jobs_df:
+                jobs_df[col] = jobs_df[col].astype("category")
+        self.pending = []
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        update_catalog = not self.catalog_ready
+        result = save_jobs_to_s3_parquet(
+            self.config, jobs_df, update_catalog=update_catalog, extraction_time=self.extraction_time
+        )
+        self.stats["flushes"] += 1
+        if self.on_flush is not None:
+            self.on_flush(jobs_df, "error" not in result)
+        if "error" in result:
+            self.stats["errors"].append(result["error"])
+            return
+        self.stats["new_jobs"] += result["new_jobs"]
+        self.stats["files_written"] += result["files_written"]
+        if update_catalog:
+            self.catalog_ready = True
+            self.stats["catalog_updates"] += 1
+            self.registered_partitions.update(result["partitions_values"])
+        else:
+            for path, values in result["partitions_values"].items():
+                if path not in self.registered_partitions:
+                    self.unregistered_partitions[path] = values
+
+    def close(self):
+        """Flush remaining rows and register any new partitions; return run statistics."""
+        self.flush()
+        if self.unregistered_partitions:
+            try:
+                import awswrangler as wr
+                wr.catalog.add_parquet_partitions(
+                    database=self.config["glue_database"],
+                    table=self.config["glue_table"],
+                    partitions_values=self.unregistered_partitions,
+                    compression="snappy"
+                )
+                self.stats["catalog_updates"] += 1
+                self.registered_partitions.update(self.unregistered_partitions)
+                self.unregistered_partitions = {}
+            except Exception as e:
+                print(f"Error registering partitions: {e}")
+                self.stats["errors"].append(str(e))
+        return self.stats
+
+
 def lambda_handler(event, context):
-    """AWS Lambda handler for Adzuna job extraction pipeline."""
+    """AWS Lambda handler for Adzuna job extraction pipeline.
+
+    Progress is checkpointed in the state item after every Parquet flush. A run
+    that is about to hit the Lambda timeout flushes, checkpoints and returns, and
+    the next invocation resumes the same extraction window from the checkpoint.
+    """
     config = get_config()
-    dynamodb = boto3.resource("dynamodb")
-    state = get_state(dynamodb, config["dynamodb_state_table"])
-    extraction_window = {
-        "start_time": datetime.fromisoformat(state["last_extraction_time"]) - timedelta(hours=config["overlap_hours"]),
-        "end_time": datetime.now()
-    }
-    total_jobs_processed = 0
-    for jobs_batch in fetch_jobs_from_adzuna(config, extraction_window):
-        if not jobs_batch.empty:
-            filtered_batch = jobs_batch[
-                (jobs_batch["job_created"] >= extraction_window["start_time"]) &
-                (jobs_batch["job_created"] <= extraction_window["end_time"])
-            ]
-            if not filtered_batch.empty:
-                result = save_jobs_to_s3_parquet(config, filtered_batch)
-                total_jobs_processed += result.get("new_jobs", 0)
-    update_state(
-        dynamodb,
-        config["dynamodb_state_table"],
-        {
-            "last_extraction_time": datetime.now().isoformat(),
-            "total_jobs_extracted": state["total_jobs_extracted"] + total_jobs_processed
-        }
+    dynamodb = get_aws_resource("dynamodb")
+    rate_limiter = get_rate_limiter(config)
+    rate_limiter.reset_counters()
+    state_manager = PipelineStateManager(dynamodb, config["dynamodb_state_table"])
+    state = state_manager.load()
+    checkpoint = state.get("checkpoint") or {}
+    run_time = datetime.fromisoformat(checkpoint["run_time"]) if checkpoint else datetime.now()
+    watermarks = state.get("query_watermarks", {})
+    progress = {}
+    plans = []
+    for query in config["search_queries"]:
+        key = query_key(query)
+        if key in checkpoint.get("queries", {}):
+            progress[key] = dict(checkpoint["queries"][key])
+        else:
+            last_extraction_time = watermarks.get(key, state["last_extraction_time"])
+            start_time = datetime.fromisoformat(last_extraction_time) - timedelta(hours=config["overlap_hours"])
+            progress[key] = {
+                "start_time": start_time.isoformat(),
+                "last_page": 0,
+                "last_flushed_job_created": None,
+                "completed": False,
+                "failed": False
+            }
+        if progress[key]["completed"]:
+            continue
+        plans.append({
+            "query": query,
+            "window": {"start_time": datetime.fromisoformat(progress[key]["start_time"]), "end_time": run_time},
+            "start_page": int(progress[key]["last_page"]) + 1
+        })
+
+    def out_of_time():
+        return context is not None and context.get_remaining_time_in_millis() < config["checkpoint_reserve_ms"]
+
+    seen_index = SeenJobIndex(
+        get_aws_client("s3"),
+        config["s3_bucket"],
+        config["seen_index_key"],
+        config["seen_index_retention_days"]
     )
+    files_written_before = int(checkpoint.get("files_written", 0))
+    # Progress of rows handed to the writer but not yet flushed, per query
+    pending = {}
+    # Queries that lost rows in a failed flush; their progress stays at the last durable page
+    held_back = set()
+
+    def commit_pending():
+        """Mark buffered progress as durable, except for queries that lost rows."""
+        for key, query_pending in pending.items():
+            query_pending.pop("has_rows", None)
+            if key not in held_back:
+                progress[key].update(query_pending)
+        pending.clear()
+        try:
+            seen_index.save()
+        except Exception as e:
+            print(f"Error saving seen-job index: {e}")
+
+    def on_flush(jobs_df, ok):
+        """Commit the ids and progress behind a flush, or hold them back so the rows are retried."""
+        if ok:
+            seen_index.commit(jobs_df)
+        else:
+            seen_index.release(jobs_df)
+            held_back.update(key for key, query_pending in pending.items() if query_pending.get("has_rows"))
+        commit_pending()
+
+    writer = ParquetBatchWriter(config, on_flush=on_flush)
+
+    def checkpoint_state():
+        return {
+            "run_time": run_time.isoformat(),
+            "queries": progress,
+            "files_written": files_written_before + writer.stats["files_written"]
+        }
+
+    fetch_stats = {}
+    for query, through_page, jobs_batch in fetch_jobs_for_queries(config, plans, fetch_stats, out_of_time):
+        key = query_key(query)
+        query_pending = pending.setdefault(key, {})
+        if jobs_batch is None:
+            query_pending.update({"completed": True, "failed": bool(fetch_stats[key].get("error"))})
+        else:
+            if not jobs_batch.empty:
+                oldest = jobs_batch["job_created"].min().isoformat()
+                previous = query_pending.get("last_flushed_job_created") or progress[key]["last_flushed_job_created"]
+                query_pending["last_flushed_job_created"] = min(oldest, previous) if previous else oldest
+            query_pending["last_page"] = max(through_page, query_pending.get("last_page", 0))
+            flushes = writer.stats["flushes"]
+            # The index is shared by all queries, so a job matched by several of them is kept once
+            new_jobs = seen_index.filter_new(jobs_batch)
+            if not new_jobs.empty:
+                query_pending["has_rows"] = True
+            writer.add(new_jobs)
+            if writer.stats["flushes"] > flushes:
+                state_manager.save(updates={"checkpoint": checkpoint_state()})
+        if out_of_time():
+            print("Approaching Lambda timeout, checkpointing and stopping")
+            break
+    write_stats = writer.close()
+    # Anything still pending has no rows left in the writer, so it is safe to commit
+    commit_pending()
+    total_jobs_processed = write_stats["new_jobs"]
+    completed = all(query_progress["completed"] for query_progress in progress.values())
+    if completed:
+        state_manager.save(
+            updates={"last_extraction_time": run_time.isoformat(), "checkpoint": None},
+            increments={"total_jobs_extracted": total_jobs_processed},
+            merges={"query_watermarks": {
+                key: run_time.isoformat() for key, query_progress in progress.items() if not query_progress["failed"]
+            }}
+        )
+    else:
+        state_manager.save(
+            updates={"checkpoint": checkpoint_state()},
+            increments={"total_jobs_extracted": total_jobs_processed}
+        )
     return {
         "statusCode": 200,
         "body": json.dumps({
             "success": True,
+            "completed": completed,
+            "resumed": bool(checkpoint),
             "jobs_processed": total_jobs_processed,
-            "extraction_window_start": extraction_window["start_time"].isoformat(),
-            "extraction_window_end": extraction_window["end_time"].isoformat()
+            "files_written": write_stats["files_written"],
+            "catalog_updates": write_stats["catalog_updates"],
+            "dedup": seen_index.report(),
+            "paging": fetch_stats,
+            "api_requests": rate_limiter.counters,
+            "state": state_manager.metrics,
+            "aws_clients": aws_init_timings(),
+            "extraction_windows": {
+                key: {"start": query_progress["start_time"], "end": run_time.isoformat()}
+                for key, query_progress in progress.items()
+            }
         })
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,63 @@
+"""Benchmark concurrent Adzuna page fetching against a local fake server.
+
+Walks every page of the fake result set at several ``fetch_concurrency``
+levels and prints pages/sec. Run with ``python bench_fetch.py`` from this
+directory; FAKE_LATENCY_MS and FAKE_TOTAL_JOBS change the fake server.
+"""
+
+import os
+import time
+from datetime import timedelta
+
+import api_data
+from fake_adzuna import FakeAdzunaServer
+
+CONCURRENCY_LEVELS = (1, 2, 4, 8)
+
+
+def bench_config(concurrency):
+    return {
+        "adzuna_app_id": "bench",
+        "adzuna_app_key": "bench",
+        "batch_size": 1000,
+        "fetch_concurrency": concurrency,
+        # High enough that only latency and concurrency limit throughput
+        "rate_limit_per_minute": 1_000_000,
+        "rate_limit_burst": 100,
+        "max_attempts": 1,
+    }
+
+
+def main():
+    latency = float(os.getenv("FAKE_LATENCY_MS", "100")) / 1000
+    total_jobs = int(os.getenv("FAKE_TOTAL_JOBS", "2000"))
+    with FakeAdzunaServer(total_jobs=total_jobs, latency=latency) as server:
+        api_data.ADZUNA_API_URL = server.url
+        # The window covers every fake job, so each run walks all pages
+        window = {
+            "start_time": server.newest - timedelta(minutes=server.minutes_between_jobs * total_jobs + 1),
+            "end_time": server.newest,
+        }
+        print(f"{total_jobs} jobs, {latency * 1000:.0f} ms latency per page")
+        print(f"{'concurrency':>11} {'pages':>6} {'requests':>8} {'seconds':>8} {'pages/sec':>9}")
+        for concurrency in CONCURRENCY_LEVELS:
+            stats = {}
+            requests_before = server.requests
+            started = time.perf_counter()
+            rows = sum(
+                len(jobs_df)
+                for _, jobs_df in api_data.fetch_jobs_from_adzuna(
+                    bench_config(concurrency), ("gb", "data engineer"), window, stats
+                )
+            )
+            elapsed = time.perf_counter() - started
+            assert rows == total_jobs, f"fetched {rows} of {total_jobs} jobs"
+            pages = stats["pages_fetched"]
+            print(
+                f"{concurrency:>11} {pages:>6} {server.requests - requests_before:>8} "
+                f"{elapsed:>8.2f} {pages / elapsed:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Micro-benchmark of JobColumnBuilder against the original parse_jobs_batch.
+
+Parses 100k synthetic jobs arriving as 50-job pages, flushed every
+``batch_size`` rows like the extractor does, and reports rows/sec and the
+peak RSS added on top of the raw jobs. Each implementation runs in its own
+interpreter so peak RSS is not shared. Run with ``python bench_job_builder.py``.
+"""
+
+import resource
+import subprocess
+import sys
+import time
+
+from fake_adzuna import RESULTS_PER_PAGE, fake_job
+
+TOTAL_JOBS = 100_000
+BATCH_SIZES = (1000, TOTAL_JOBS)
+REPEATS = 3
+
+
+def original_parse_jobs_batch(raw_jobs):
+    """parse_jobs_batch as it was before JobColumnBuilder, kept verbatim as the baseline."""
+    import pandas as pd
+    if not raw_jobs:
+        return pd.DataFrame()
+    jobs_data = {
+        "job_id": [job.get("id") for job in raw_jobs],
+        "job_title": [job.get("title") for job in raw_jobs],
+        "job_location": [job.get("location", {}).get("display_name") for job in raw_jobs],
+        "job_company": [job.get("company", {}).get("display_name") for job in raw_jobs],
+        "job_category": [job.get("category", {}).get("label") for job in raw_jobs],
+        "job_description": [job.get("description") for job in raw_jobs],
+        "job_url": [job.get("redirect_url") for job in raw_jobs],
+        "job_created": [job.get("created") for job in raw_jobs]
+    }
+    df = pd.DataFrame(jobs_data)
+    df["job_created"] = pd.to_datetime(df["job_created"])
+    df = df.dropna(subset=["job_id", "job_title", "job_created"])
+    # Optimize types
+    for col in ["job_location", "job_company", "job_category"]:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def run_original(pages, batch_size):
+    """Collect raw pages into batches and parse each one, as the extractor used to."""
+    rows = 0
+    batch = []
+    for page in pages:
+        batch.extend(page)
+        if len(batch) >= batch_size:
+            rows += len(original_parse_jobs_batch(batch))
+            batch = []
+    if batch:
+        rows += len(original_parse_jobs_batch(batch))
+    return rows
+
+
+def run_builder(pages, batch_size):
+    """Copy each page into the column buffers and flush when full, as the extractor does now."""
+    from api_data import JobColumnBuilder
+    rows = 0
+    builder = JobColumnBuilder(batch_size, country="gb")
+    for page in pages:
+        taken = 0
+        while taken < len(page):
+            taken += builder.extend(page, taken)
+            if builder.full:
+                rows += len(builder.flush())
+    if len(builder):
+        rows += len(builder.flush())
+    return rows
+
+
+IMPLEMENTATIONS = {"parse_jobs_batch": run_original, "JobColumnBuilder": run_builder}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(name, batch_size):
+    """Run one implementation in this process and print 'rows_per_sec peak_rss_delta_mb'."""
+    import pandas  # noqa: F401  imported up front so its memory is not charged to either side
+    import api_data  # noqa: F401
+    jobs = [fake_job(index) for index in range(TOTAL_JOBS)]
+    pages = [jobs[start:start + RESULTS_PER_PAGE] for start in range(0, TOTAL_JOBS, RESULTS_PER_PAGE)]
+    baseline_mb = peak_rss_mb()
+    best = float("inf")
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        rows = IMPLEMENTATIONS[name](pages, batch_size)
+        best = min(best, time.perf_counter() - started)
+    assert rows == TOTAL_JOBS, f"{name} parsed {rows} of {TOTAL_JOBS} jobs"
+    print(f"{TOTAL_JOBS / best:.0f} {peak_rss_mb() - baseline_mb:.1f}")
+
+
+def main():
+    print(f"{TOTAL_JOBS} synthetic jobs in {RESULTS_PER_PAGE}-job pages, best of {REPEATS}")
+    print(f"{'implementation':>17} {'batch':>7} {'rows/sec':>10} {'peak RSS +MB':>13}")
+    for batch_size in BATCH_SIZES:
+        for name in IMPLEMENTATIONS:
+            result = subprocess.run(
+                [sys.executable, __file__, name, str(batch_size)], capture_output=True, text=True, check=True
+            )
+            rows_per_sec, rss_mb = result.stdout.split()
+            print(f"{name:>17} {batch_size:>7} {float(rows_per_sec):>10,.0f} {float(rss_mb):>13.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        measure(sys.argv[1], int(sys.argv[2]))
+    else:
+        main()
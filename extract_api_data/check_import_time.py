@@ -0,0 +1,56 @@
+"""Cold-start guard for the Adzuna Lambda: fails when importing api_data gets heavy.
+
+Importing api_data must not pull in the data stack, which is only needed once
+there are jobs to write, and its cumulative import time must stay within
+IMPORT_BUDGET_MS. Run with ``python check_import_time.py`` from this directory.
+"""
+
+import os
+import subprocess
+import sys
+
+# Loaded lazily by api_data, only on the paths that use them
+DEFERRED_MODULES = ("awswrangler", "pandas", "numpy", "pyarrow")
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "400"))
+
+PROBE = (
+    "import sys, api_data; "
+    f"print(','.join(name for name in {DEFERRED_MODULES!r} if name in sys.modules))"
+)
+
+
+def import_report():
+    """Import api_data in a fresh interpreter; return the deferred modules it loaded and its import time."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        sys.exit(f"FAIL: import api_data raised\n{result.stderr.splitlines()[-1]}")
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    # Lines look like "import time:   self [us] | cumulative | imported package"
+    cumulative_us = 0
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "api_data":
+            cumulative_us = int(fields[1])
+    return loaded, cumulative_us / 1000
+
+
+def main():
+    loaded, import_ms = import_report()
+    print(f"import api_data: {import_ms:.1f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)")
+    failures = []
+    if loaded:
+        failures.append(f"imported eagerly: {', '.join(loaded)}")
+    if import_ms > IMPORT_BUDGET_MS:
+        failures.append(f"import took {import_ms:.1f} ms, over the {IMPORT_BUDGET_MS:.0f} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
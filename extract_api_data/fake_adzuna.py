@@ -0,0 +1,81 @@
+"""Local stand-in for the Adzuna search API, used by the benchmarks in this directory.
+
+Serves ``/<country>/search/<page>`` with ``total_jobs`` jobs sorted newest first,
+one every ``minutes_between_jobs`` minutes back from ``newest``, after an
+injected ``latency`` per request.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESULTS_PER_PAGE = 50
+
+
+def fake_job(index, newest=datetime(2030, 1, 2), minutes_between_jobs=3):
+    """The index-th newest job of the fake result set, shaped like an Adzuna result."""
+    created = newest - timedelta(minutes=minutes_between_jobs * index)
+    return {
+        "id": str(100000 + index),
+        "title": f"Data Engineer {index}",
+        "created": created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "location": {"display_name": f"City {index % 20}"},
+        "company": {"display_name": f"Company {index % 50}"},
+        "category": {"label": "IT Jobs"},
+        "description": "Builds pipelines. " * 10,
+        "redirect_url": f"https://example.com/jobs/{index}",
+    }
+
+
+class FakeAdzunaServer:
+    """Threaded HTTP server on a free local port; use as a context manager."""
+
+    def __init__(self, total_jobs=2000, minutes_between_jobs=3, latency=0.05, newest=datetime(2030, 1, 2)):
+        self.total_jobs = total_jobs
+        self.minutes_between_jobs = minutes_between_jobs
+        self.latency = latency
+        self.newest = newest
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def job(self, index):
+        return fake_job(index, self.newest, self.minutes_between_jobs)
+
+    def page(self, page):
+        start = (page - 1) * RESULTS_PER_PAGE
+        results = [self.job(index) for index in range(start, min(start + RESULTS_PER_PAGE, self.total_jobs))]
+        return {"results": results, "count": self.total_jobs}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.requests += 1
+                time.sleep(fake.latency)
+                page = int(self.path.split("?")[0].rstrip("/").rsplit("/", 1)[1])
+                body = json.dumps(fake.page(page)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
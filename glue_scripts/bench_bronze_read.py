@@ -0,0 +1,188 @@
+"""
+Times the bronze read of raw movie files with an inferred schema and with the registered one.
+
+Generates synthetic movie files shaped like the raw payload, then reads them
+the way bronze_glue_script.py does:
+  inferred        - Spark scans every file to infer the schema (the job before the registry)
+  explicit        - the registered schema is passed in, with a corrupt record column
+  explicit+sample - a few files are inferred for the drift check, then the explicit read
+Each read hashes every payload column, so all fields are parsed, and the best of
+--repeats runs is reported.
+
+Runs under local PySpark or as a Glue job (Glue's own arguments are ignored):
+  python bench_bronze_read.py --path /tmp/bench_movies --files 200 --rows 500
+  --path s3://<bucket>/bench/movies/ writes and reads the files in S3
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import date, timedelta
+from typing import List
+
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql.types import StringType, StructField, StructType
+
+CORRUPT_RECORD_COLUMN = "_corrupt_record"
+DRIFT_SAMPLE_FILES = 3
+
+GENRES = ["Action", "Comedy", "Drama", "Horror", "Sci-Fi", "Romance", "Thriller", "Animation"]
+STUDIOS = ["Warner Bros", "Universal", "Paramount", "Disney", "Sony", "Lionsgate", "A24"]
+RATINGS = ["G", "PG", "PG-13", "R", "NC-17"]
+
+
+def fake_movie(movie_id: int, rng: random.Random) -> dict:
+    """
+    One raw movie record
+
+    :param movie_id : id of the record
+    :param rng : random source, seeded so every run generates the same data
+
+    :return movie dict as the raw bucket stores it
+    """
+    return {
+        "id": movie_id,
+        "title": f"Movie {movie_id}",
+        "genre": rng.choice(GENRES),
+        "studio": rng.choice(STUDIOS),
+        "director": f"Director {rng.randrange(500)}",
+        "release_date": (date(1980, 1, 1) + timedelta(days=rng.randrange(16000))).isoformat(),
+        "runtime": rng.randrange(80, 200),
+        "rating": rng.choice(RATINGS),
+        "budget": round(rng.uniform(1e5, 2e8), 2),
+        "box_office": round(rng.uniform(0, 1e9), 2),
+        "vote_average": round(rng.uniform(1, 10), 1),
+        "vote_count": rng.randrange(50000),
+        "overview": " ".join(f"word{rng.randrange(1000)}" for _ in range(40)),
+    }
+
+
+def generate(path: str, files: int, rows: int, input_format: str) -> List[str]:
+    """
+    Write synthetic movie files, as JSON arrays or JSON lines
+
+    :param path : local directory or s3://bucket/prefix/
+    :param files : number of files
+    :param rows : movies per file
+    :param input_format : 'json' or 'jsonl'
+
+    :return paths of the written files, in the form Spark reads them
+    """
+    rng = random.Random(42)
+    s3_client = None
+    if path.startswith("s3://"):
+        import boto3
+        s3_client = boto3.client("s3")
+        bucket, _, prefix = path[len("s3://"):].partition("/")
+    else:
+        os.makedirs(path, exist_ok=True)
+
+    written = []
+    for file_index in range(files):
+        movies = [fake_movie(file_index * rows + row, rng) for row in range(rows)]
+        body = "\n".join(json.dumps(movie) for movie in movies) if input_format == "jsonl" else json.dumps(movies)
+        name = f"movies_{file_index:05d}.{input_format}"
+        if s3_client:
+            key = f"{prefix.rstrip('/')}/{name}".lstrip("/")
+            s3_client.put_object(Bucket=bucket, Key=key, Body=body.encode())
+            written.append(f"s3://{bucket}/{key}")
+        else:
+            file_path = os.path.join(path, name)
+            with open(file_path, "w") as f:
+                f.write(body)
+            written.append(file_path)
+    return written
+
+
+def json_reader(spark: SparkSession, input_format: str):
+    reader = spark.read
+    return reader if input_format == "jsonl" else reader.option("multiline", "true")
+
+
+def materialize(df: DataFrame) -> int:
+    """
+    Parse every payload field of a read, as the bronze write does
+
+    A bare count could skip parsing when the schema is known, which would flatter the explicit read.
+
+    :param df : dataframe returned by the reader
+
+    :return row count
+    """
+    columns = [name for name in df.columns if name != CORRUPT_RECORD_COLUMN]
+    return df.select(F.hash(*columns).alias("row_hash")).agg(F.count("*"), F.sum("row_hash")).collect()[0][0]
+
+
+def read_inferred(spark: SparkSession, paths: List[str], input_format: str) -> int:
+    return materialize(json_reader(spark, input_format).json(paths))
+
+
+def read_explicit(spark: SparkSession, paths: List[str], input_format: str, schema: StructType) -> int:
+    reader = (
+        json_reader(spark, input_format)
+        .schema(StructType(schema.fields + [StructField(CORRUPT_RECORD_COLUMN, StringType())]))
+        .option("mode", "PERMISSIVE")
+        .option("columnNameOfCorruptRecord", CORRUPT_RECORD_COLUMN)
+    )
+    return materialize(reader.json(paths))
+
+
+def read_explicit_with_sample(spark: SparkSession, paths: List[str], input_format: str, schema: StructType) -> int:
+    step = max(1, len(paths) // DRIFT_SAMPLE_FILES)
+    # Creating the DataFrame is what scans the sample to infer its schema
+    json_reader(spark, input_format).json(paths[::step][:DRIFT_SAMPLE_FILES])
+    return read_explicit(spark, paths, input_format, schema)
+
+
+def best_of(repeats: int, read) -> tuple:
+    """
+    Run a read several times
+
+    :param repeats : number of timed runs
+    :param read : callable returning the row count
+
+    :return (fastest run in seconds, row count)
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        rows = read()
+        timings.append(time.perf_counter() - start)
+    return min(timings), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bronze read time with an inferred vs an explicit schema")
+    parser.add_argument("--path", default="/tmp/bench_movies")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--format", dest="input_format", choices=["json", "jsonl"], default="json")
+    parser.add_argument("--repeats", type=int, default=3)
+    args, _ = parser.parse_known_args()
+
+    spark = SparkSession.builder.appName("bench_bronze_read").getOrCreate()
+    paths = generate(args.path, args.files, args.rows, args.input_format)
+
+    # The registered schema is what inference produced on the first load
+    schema = json_reader(spark, args.input_format).json(paths[0]).schema
+
+    # One untimed pass of each reader warms up the JVM and the file system client
+    read_inferred(spark, paths, args.input_format)
+    read_explicit(spark, paths, args.input_format, schema)
+
+    modes = {
+        "inferred": lambda: read_inferred(spark, paths, args.input_format),
+        "explicit": lambda: read_explicit(spark, paths, args.input_format, schema),
+        "explicit+sample": lambda: read_explicit_with_sample(spark, paths, args.input_format, schema),
+    }
+    print(f"{args.files} {args.input_format} files x {args.rows} movies, best of {args.repeats}")
+    print(f"{'mode':>16} {'rows':>9} {'seconds':>8}")
+    for mode, read in modes.items():
+        seconds, rows = best_of(args.repeats, read)
+        print(f"{mode:>16} {rows:>9} {seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
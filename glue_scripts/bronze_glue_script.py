@@ -1,12 +1,29 @@
+import json
 import sys
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+import boto3
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
 from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import DoubleType, IntegerType, LongType, StringType, StructField, StructType
 import logging
 
 args = getResolvedOptions(sys.argv, ['JOB_NAME'])
+
+# 'full' reloads every raw file, 'incremental' appends only files not ingested yet
+ingest_mode = 'full'
+if '--INGEST_MODE' in sys.argv:
+    ingest_mode = getResolvedOptions(sys.argv, ['INGEST_MODE'])['INGEST_MODE']
+
+# 'json' reads whole-file JSON documents, 'jsonl' reads line-delimited files Spark can split
+input_format = 'json'
+if '--INPUT_FORMAT' in sys.argv:
+    input_format = getResolvedOptions(sys.argv, ['INPUT_FORMAT'])['INPUT_FORMAT']
+
 sc = SparkContext()
 glueContext = GlueContext(sc)
 
@@ -31,44 +48,321 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Registered versions of the raw movies payload live on the bronze table; a new field adds a version
+SCHEMA_VERSION_PROPERTY = "oakvale.movies_schema_version"
+SCHEMA_PROPERTY_PREFIX = "oakvale.movies_schema_v"
+# Columns bronze adds to every row, not part of the raw payload
+BOOKKEEPING_COLUMNS = ("schema_version", "ingest_batch_id")
+CORRUPT_RECORD_COLUMN = "_corrupt_record"
+DRIFT_SAMPLE_FILES = 3
 
-def read_raw_data(path: str) -> DataFrame:
+
+def table_properties(table: str, database: str) -> Dict[str, str]:
     """
-    Read data from s3
+    Read the properties of a catalog table
 
-    :param path : path to the file stored in S3
+    :param table : table name
+    :param database : glue database name
+    """
+    return {row.key: row.value for row in spark.sql(f"SHOW TBLPROPERTIES {database}.{table}").collect()}
 
-    :return spark dataframe
+
+def registered_schema(table: str, database: str) -> Tuple[int, Optional[StructType]]:
+    """
+    Latest registered version of the raw movies payload schema
+
+    Bronze tables loaded before the registry existed were written with an inferred schema,
+    so their payload columns are registered as version 1.
+
+    :param table : bronze table name
+    :param database : glue database name
+
+    :return (version, schema), or (0, None) if bronze has never been loaded
+    """
+    if not spark.catalog.tableExists(table, database):
+        return 0, None
+    properties = table_properties(table, database)
+    version = properties.get(SCHEMA_VERSION_PROPERTY)
+    if version is not None:
+        return int(version), StructType.fromJson(json.loads(properties[f"{SCHEMA_PROPERTY_PREFIX}{version}"]))
+    table_schema = spark.table(f"{database}.{table}").schema
+    return 1, StructType([field for field in table_schema.fields if field.name not in BOOKKEEPING_COLUMNS])
+
+
+def register_schema(table: str, database: str, version: int, schema: StructType):
     """
-    df = spark.read.option("multiline", "true").json(path)
+    Store a payload schema version on the bronze table, unless it is already the latest one
+
+    :param table : bronze table name
+    :param database : glue database name
+    :param version : schema version
+    :param schema : payload schema of that version
+    """
+    if table_properties(table, database).get(SCHEMA_VERSION_PROPERTY) == str(version):
+        return
+    schema_json = schema.json().replace("\\", "\\\\").replace("'", "\\'")
+    spark.sql(
+        f"ALTER TABLE {database}.{table} SET TBLPROPERTIES ("
+        f"'{SCHEMA_PROPERTY_PREFIX}{version}' = '{schema_json}', '{SCHEMA_VERSION_PROPERTY}' = '{version}')"
+    )
+    logger.info(f"Registered movies schema v{version} on {database}.{table}")
+
+
+def read_raw_data(path, schema: StructType) -> DataFrame:
+    """
+    Read data from s3 with a fixed schema, so Spark does not scan the input to infer one
+
+    :param path : path, or list of paths, to the files stored in S3
+    :param schema : registered schema of the payload
+
+    :return spark dataframe, with unparseable records kept in _corrupt_record
+    """
+    reader = (
+        spark.read.schema(StructType(schema.fields + [StructField(CORRUPT_RECORD_COLUMN, StringType())]))
+        .option("mode", "PERMISSIVE")
+        .option("columnNameOfCorruptRecord", CORRUPT_RECORD_COLUMN)
+    )
+    if input_format != 'jsonl':
+        reader = reader.option("multiline", "true")
+    df = reader.json(path)
     return df
 
 
-def write_delta_tables(table: str, database: str, df: DataFrame):
+def infer_schema(paths: List[str]) -> StructType:
+    """
+    Infer the payload schema of some source files
+
+    :param paths : source files to read
+
+    :return schema without the corrupt record column
+    """
+    reader = spark.read if input_format == 'jsonl' else spark.read.option("multiline", "true")
+    return StructType([field for field in reader.json(paths).schema.fields if field.name != CORRUPT_RECORD_COLUMN])
+
+
+def sample_files(paths: List[str], count: int = DRIFT_SAMPLE_FILES) -> List[str]:
+    """
+    Pick up to count files spread evenly over a list, first and last included
+
+    :param paths : source files
+    :param count : number of files to pick
+    """
+    if len(paths) <= count:
+        return paths
+    step = (len(paths) - 1) / (count - 1)
+    return [paths[round(i * step)] for i in range(count)]
+
+
+def detect_schema_drift(inferred_schema: StructType, schema: StructType) -> Dict[str, List[str]]:
+    """
+    Compare the schema inferred from sampled source files with the registered schema
+
+    :param inferred_schema : schema inferred from a few source files
+    :param schema : registered schema of the payload
+
+    :return dict of added, missing and retyped top-level fields
+    """
+    inferred = {field.name: field.dataType for field in inferred_schema.fields}
+    expected = {field.name: field.dataType for field in schema.fields}
+    numeric = (DoubleType(), LongType(), IntegerType())
+    # Numbers widen to double and string fields accept any scalar, so neither counts as drift
+    retyped = [
+        name for name, data_type in inferred.items()
+        if name in expected and data_type != expected[name]
+        and not (data_type in numeric and expected[name] in numeric)
+        and not (expected[name] == StringType() and data_type in numeric)
+    ]
+    return {
+        "added": sorted(set(inferred) - set(expected)),
+        "missing": sorted(set(expected) - set(inferred)),
+        "retyped": sorted(retyped),
+    }
+
+
+def align_to_table(df: DataFrame, table: str, database: str) -> DataFrame:
+    """
+    Cast columns to the types an existing table already uses, so appends do not conflict
+
+    :param df : spark dataframe to append
+    :param table : target table name
+    :param database : glue database name
+
+    :return spark dataframe
+    """
+    table_types = {field.name: field.dataType for field in spark.table(f"{database}.{table}").schema.fields}
+    return df.select([
+        F.col(field.name).cast(table_types[field.name]).alias(field.name)
+        if field.name in table_types and table_types[field.name] != field.dataType
+        else F.col(field.name)
+        for field in df.schema.fields
+    ])
+
+
+def publish_metrics(metrics: Dict[str, float], schema_version: int):
+    """
+    Publish ingest metrics to CloudWatch; failures are logged and never fail the job
+
+    :param metrics : metric name to value
+    :param schema_version : movies schema version the files were read with
+    """
+    try:
+        boto3.client("cloudwatch").put_metric_data(
+            Namespace="Oakvale/Lakehouse",
+            MetricData=[
+                {
+                    "MetricName": name,
+                    "Dimensions": [
+                        {"Name": "JobName", "Value": args['JOB_NAME']},
+                        {"Name": "SchemaVersion", "Value": str(schema_version)},
+                    ],
+                    "Value": float(value),
+                    "Unit": "Count",
+                }
+                for name, value in metrics.items()
+            ],
+        )
+    except Exception as e:
+        logger.warning(f"Could not publish metrics {metrics}: {e}")
+
+
+def list_source_files(pattern: str) -> List[Tuple[str, int, int]]:
+    """
+    List the raw files matching a glob without reading them
+
+    :param pattern : S3 glob, e.g. s3://bucket/Movies/*/*.json
+
+    :return list of (path, size in bytes, modification time in ms)
+    """
+    hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(pattern)
+    fs = hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration())
+    statuses = fs.globStatus(hadoop_path) or []
+    return [
+        (status.getPath().toString(), status.getLen(), status.getModificationTime())
+        for status in statuses
+        if status.isFile()
+    ]
+
+
+def read_ingested_files(table: str, database: str) -> Set[str]:
+    """
+    Read the paths already recorded in the processed-files log
+
+    :param table : processed-files log table name
+    :param database : glue database name
+
+    :return set of source file paths
+    """
+    rows = spark.table(f"{database}.{table}").select("file_path").collect()
+    return {row.file_path for row in rows}
+
+
+def record_ingested_files(table: str, database: str, files: List[Tuple[str, int, int]],
+                          batch_id: str, mode: str = "append"):
+    """
+    Add ingested source files to the processed-files log
+
+    :param table : processed-files log table name
+    :param database : glue database name
+    :param files : list of (path, size, modification time) that were ingested
+    :param batch_id : ingest batch the files were loaded in
+    :param mode : "append", or "overwrite" to restart the log after a full load
+    """
+    ingested_at = datetime.utcnow()
+    log_df = spark.createDataFrame(
+        [(path, size, modified, batch_id, ingested_at) for path, size, modified in files],
+        "file_path string, file_size long, modification_time long, ingest_batch_id string, ingested_at timestamp",
+    )
+    write_delta_tables(table, database, log_df, mode)
+
+
+def write_delta_tables(table: str, database: str, df: DataFrame, mode: str = "overwrite",
+                       keep_columns: bool = False):
     """
     Write to delta lake on S3 and glue catalog
 
     :param table : delta table name (will be use in Glue datacatalog)
     :param database : glue database name
     :param df : spark dataframe
+    :param mode : "overwrite" replaces the table, "append" adds the rows
+    :param keep_columns : on overwrite, merge the schema instead of replacing it, so no column is dropped
     """
-    df.write.format("delta").mode("overwrite").saveAsTable(f"{database}.{table}")
+    writer = df.write.format("delta").mode(mode)
+    if mode == "overwrite" and not keep_columns:
+        writer = writer.option("overwriteSchema", "true")
+    else:
+        writer = writer.option("mergeSchema", "true")
+    writer.saveAsTable(f"{database}.{table}")
     logger.info(f"Table {table} successfully loaded to {database} database!!")
 
 
 def main():
     # Path to raw movie data in S3
-    movies_path = "s3://oakvale-raw-data/Movies/*/*.json"
-    
-    # Read raw data
-    movies_df = read_raw_data(movies_path)
+    movies_path = f"s3://oakvale-raw-data/Movies/*/*.{input_format}"
     
     # Define table name and database
     movies_table = "movies_info"
+    files_table = "movies_ingested_files"
     database = "oakvale_bronze"
     
-    # Write to delta table
-    write_delta_tables(movies_table, database, movies_df)
+    # Every row records the ingest batch it was loaded in
+    batch_id = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    source_files = list_source_files(movies_path)
+    
+    # Without a log there is no way to tell which files bronze already holds, so reload everything
+    full_load = ingest_mode != 'incremental' or not spark.catalog.tableExists(files_table, database)
+    if full_load:
+        new_files = source_files
+    else:
+        ingested = read_ingested_files(files_table, database)
+        new_files = [source_file for source_file in source_files if source_file[0] not in ingested]
+    
+    logger.info(
+        f"Ingest batch {batch_id}: {len(new_files)} of {len(source_files)} source files to load "
+        f"({'full' if full_load else 'incremental'})"
+    )
+    if not new_files:
+        logger.info("No new source files, bronze is up to date")
+        return
+    
+    new_paths = [path for path, _, _ in new_files]
+    version, schema = registered_schema(movies_table, database)
+    bronze_exists = schema is not None
+    if not bronze_exists:
+        # First load: infer from every file, as the job always did, and register the result
+        version, schema = 1, infer_schema(new_paths)
+    
+    # Drift is reported as a metric; new fields are kept under a new schema version instead of dropped
+    sampled = infer_schema(sample_files(new_paths))
+    drift = detect_schema_drift(sampled, schema)
+    if any(drift.values()):
+        logger.warning(f"Schema drift against movies schema v{version}: {drift}")
+    if drift["added"]:
+        schema = StructType(schema.fields + [sampled[name] for name in drift["added"]])
+        version += 1
+    
+    # Read raw data; cached so counting corrupt records and the write share one scan
+    movies_df = read_raw_data(new_paths, schema).cache()
+    corrupt_records = movies_df.where(F.col(CORRUPT_RECORD_COLUMN).isNotNull()).count()
+    if corrupt_records:
+        logger.warning(f"{corrupt_records} records do not match movies schema v{version}")
+    publish_metrics({
+        "SchemaDriftFields": sum(len(fields) for fields in drift.values()),
+        "CorruptRecords": corrupt_records,
+        "SourceFilesIngested": len(new_files),
+    }, version)
+    movies_df = (
+        movies_df.drop(CORRUPT_RECORD_COLUMN)
+        .withColumn("schema_version", F.lit(version))
+        .withColumn("ingest_batch_id", F.lit(batch_id))
+    )
+    if bronze_exists:
+        movies_df = align_to_table(movies_df, movies_table, database)
+    
+    # Write to delta table, then record the files; a failure in between re-ingests them next run.
+    # A full reload of an existing table merges its schema, so columns it already holds are never dropped
+    write_delta_tables(movies_table, database, movies_df, "overwrite" if full_load else "append", keep_columns=True)
+    register_schema(movies_table, database, version, schema)
+    record_ingested_files(files_table, database, new_files, batch_id, "overwrite" if full_load else "append")
 
 
 if __name__ == '__main__':
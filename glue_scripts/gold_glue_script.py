@@ -1,13 +1,23 @@
+import json
 import sys
+import time
+from typing import Dict, List, Optional
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
 from pyspark.sql import DataFrame
 from pyspark.sql import functions as F
+from pyspark import StorageLevel
 import logging
 
 args = getResolvedOptions(sys.argv, ['JOB_NAME'])
+
+# 'full' recomputes gold from all of silver, 'incremental' folds in only silver changes
+ingest_mode = 'full'
+if '--INGEST_MODE' in sys.argv:
+    ingest_mode = getResolvedOptions(sys.argv, ['INGEST_MODE'])['INGEST_MODE']
+
 sc = SparkContext()
 glueContext = GlueContext(sc)
 
@@ -32,73 +42,198 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Mergeable sums and counts stored in every gold table; the averages are derived from them
+PARTIAL_COLUMNS = [
+    'movie_count',
+    'budget_sum', 'budget_count',
+    'box_office_sum', 'box_office_count',
+    'vote_sum', 'vote_count',
+]
+
+DERIVED_METRICS = {
+    'avg_budget': "ROUND(budget_sum / NULLIF(budget_count, 0), 2)",
+    'avg_box_office': "ROUND(box_office_sum / NULLIF(box_office_count, 0), 2)",
+    'avg_rating': "ROUND(vote_sum / NULLIF(vote_count, 0), 2)",
+    'total_box_office': "CASE WHEN box_office_count > 0 THEN ROUND(box_office_sum, 2) END",
+}
+
+# Gold table -> (grouping column, derived metrics it publishes)
+GOLD_TABLES = {
+    'genre_metrics': ('genre', ['avg_budget', 'avg_box_office', 'avg_rating']),
+    'studio_metrics': ('studio', ['avg_budget', 'avg_box_office', 'total_box_office']),
+    'year_metrics': ('release_year', ['avg_budget', 'avg_box_office', 'avg_rating']),
+}
+
+# Silver columns the metrics read; everything else is pruned from the scan
+SOURCE_COLUMNS = sorted({key for key, _ in GOLD_TABLES.values()} | {'id', 'budget', 'box_office', 'vote_average'})
+
+# Commit metadata recording which silver version a gold table reflects
+SILVER_VERSION_TAG = "silver_version="
+
+
+def delta_path(table: str, database: str) -> str:
+    return f"s3://oakvale-lakehouse/lakehouse/{database}/{table}"
+
 
-def read_delta_table(table: str, database: str) -> DataFrame:
+def read_delta_table(table: str, database: str, version: Optional[int] = None) -> DataFrame:
     """
     Read delta table stored in s3
 
     :param table : the table name
     :param database : the database name
+    :param version : table version to read, latest if None
     """
-    df = spark.read.format('delta').load(
-        f"s3://oakvale-lakehouse/lakehouse/{database}/{table}"
-    )
+    reader = spark.read.format('delta')
+    if version is not None:
+        reader = reader.option("versionAsOf", version)
+    df = reader.load(delta_path(table, database))
     logger.info(f"Table {database}.{table} successfully loaded from delta lake!!")
     return df
 
 
-def genre_metrics(movies_df: DataFrame) -> DataFrame:
+def latest_version(path: str) -> int:
     """
-    Calculate metrics by genre: avg budget, avg box office, count
+    Latest committed version of a delta table
 
-    :param movies_df : movies spark dataframe
+    :param path : delta table location
+    """
+    return spark.sql(f"DESCRIBE HISTORY delta.`{path}` LIMIT 1").collect()[0]["version"]
 
-    :return spark dataframe
+
+def enable_change_data_feed(path: str) -> bool:
     """
-    genre_metrics_df = movies_df.groupBy('genre').agg(
-        F.count('id').alias('movie_count'),
-        F.round(F.avg('budget'), 2).alias('avg_budget'),
-        F.round(F.avg('box_office'), 2).alias('avg_box_office'),
-        F.round(F.avg('vote_average'), 2).alias('avg_rating')
+    Turn on the change data feed of a delta table if it is off
+
+    :param path : delta table location
+
+    :return True if the feed had to be enabled, i.e. earlier versions have no change data
+    """
+    properties = spark.sql(f"DESCRIBE DETAIL delta.`{path}`").collect()[0]["properties"] or {}
+    if properties.get("delta.enableChangeDataFeed", "false").lower() == "true":
+        return False
+    spark.sql(f"ALTER TABLE delta.`{path}` SET TBLPROPERTIES (delta.enableChangeDataFeed = true)")
+    logger.info(f"Enabled change data feed on {path}")
+    return True
+
+
+def processed_silver_version(table: str, database: str) -> Optional[int]:
+    """
+    Silver version recorded on the latest tagged commit of a gold table
+
+    :param table : gold table name
+    :param database : gold database name
+
+    :return version, or None if the table is missing or was never tagged
+    """
+    if not spark.catalog.tableExists(table, database):
+        return None
+    tagged = (
+        spark.sql(f"DESCRIBE HISTORY {database}.{table}")
+        .where(F.col("userMetadata").startswith(SILVER_VERSION_TAG))
+        .orderBy(F.col("version").desc())
+        .select("userMetadata")
+        .first()
     )
-    
-    return genre_metrics_df
+    return int(tagged.userMetadata[len(SILVER_VERSION_TAG):]) if tagged else None
 
 
-def studio_metrics(movies_df: DataFrame) -> DataFrame:
+def read_silver_changes(path: str, start_version: int, end_version: int) -> DataFrame:
     """
-    Calculate metrics by studio: movie count, avg budget, avg box office
+    Silver rows changed between two versions, signed +1 for new values and -1 for old ones
 
-    :param movies_df : movies spark dataframe
+    :param path : silver delta table location
+    :param start_version : first version to read, inclusive
+    :param end_version : last version to read, inclusive
 
-    :return spark dataframe
+    :return spark dataframe with a _sign column
     """
-    studio_metrics_df = movies_df.groupBy('studio').agg(
-        F.count('id').alias('movie_count'),
-        F.round(F.avg('budget'), 2).alias('avg_budget'),
-        F.round(F.avg('box_office'), 2).alias('avg_box_office'),
-        F.round(F.sum('box_office'), 2).alias('total_box_office')
-    ).orderBy(F.col('total_box_office').desc())
+    return (
+        spark.read.format("delta")
+        .option("readChangeFeed", "true")
+        .option("startingVersion", start_version)
+        .option("endingVersion", end_version)
+        .load(path)
+        # Deletes and pre-images retract old values, inserts and post-images add new ones
+        .withColumn("_sign", F.when(F.col("_change_type").isin("insert", "update_postimage"), 1).otherwise(-1))
+        .select(*SOURCE_COLUMNS, "_sign")
+    )
+
+
+def grouping_id(keys: List[str], key: str) -> int:
+    """
+    GROUPING_ID value of the grouping set that groups by key alone
+
+    :param keys : all grouping columns, in GROUPING_ID argument order
+    :param key : the column the set groups by
+    """
+    return sum(1 << (len(keys) - 1 - position) for position, other in enumerate(keys) if other != key)
+
+
+def partial_aggregates(movies_df: DataFrame) -> Dict[str, DataFrame]:
+    """
+    Sums and counts for every gold table in one aggregation over GROUPING SETS
+
+    Rows with a _sign column add or retract their values. The grouped result is
+    persisted, so all gold outputs come from a single pass over the input.
+
+    :param movies_df : movies spark dataframe with SOURCE_COLUMNS, optionally _sign
+
+    :return gold table name -> spark dataframe with its key and PARTIAL_COLUMNS
+    """
+    if '_sign' not in movies_df.columns:
+        movies_df = movies_df.withColumn('_sign', F.lit(1))
+    movies_df.createOrReplaceTempView("gold_source")
+    keys = [key for key, _ in GOLD_TABLES.values()]
+
+    def signed_count(column: str) -> str:
+        return f"CAST(SUM(CASE WHEN {column} IS NOT NULL THEN _sign ELSE 0 END) AS BIGINT)"
+
+    def signed_sum(column: str) -> str:
+        return f"CAST(COALESCE(SUM(_sign * {column}), 0) AS DOUBLE)"
+
+    grouped_df = spark.sql(f"""
+        SELECT
+            {', '.join(keys)},
+            GROUPING_ID({', '.join(keys)}) AS grouping_id,
+            {signed_count('id')} AS movie_count,
+            {signed_sum('budget')} AS budget_sum,
+            {signed_count('budget')} AS budget_count,
+            {signed_sum('box_office')} AS box_office_sum,
+            {signed_count('box_office')} AS box_office_count,
+            {signed_sum('vote_average')} AS vote_sum,
+            {signed_count('vote_average')} AS vote_count
+        FROM gold_source
+        GROUP BY GROUPING SETS ({', '.join(f'({key})' for key in keys)})
+    """).persist(StorageLevel.MEMORY_AND_DISK)
+    grouped_df.count()
     
-    return studio_metrics_df
+    return {
+        table: grouped_df.where(F.col('grouping_id') == grouping_id(keys, key)).select(key, *PARTIAL_COLUMNS)
+        for table, (key, _) in GOLD_TABLES.items()
+    }
 
 
-def year_metrics(movies_df: DataFrame) -> DataFrame:
+def with_derived_metrics(partials_df: DataFrame, metrics: List[str]) -> DataFrame:
     """
-    Calculate metrics by release year: movie count, avg budget, avg box office
+    Add the published averages and totals computed from the partial aggregates
 
-    :param movies_df : movies spark dataframe
+    :param partials_df : spark dataframe with PARTIAL_COLUMNS
+    :param metrics : names from DERIVED_METRICS
 
     :return spark dataframe
     """
-    year_metrics_df = movies_df.groupBy('release_year').agg(
-        F.count('id').alias('movie_count'),
-        F.round(F.avg('budget'), 2).alias('avg_budget'),
-        F.round(F.avg('box_office'), 2).alias('avg_box_office'),
-        F.round(F.avg('vote_average'), 2).alias('avg_rating')
-    ).orderBy('release_year')
-    
-    return year_metrics_df
+    for metric in metrics:
+        partials_df = partials_df.withColumn(metric, F.expr(DERIVED_METRICS[metric]))
+    return partials_df
+
+
+def table_size_bytes(path: str) -> int:
+    """
+    Size of the current snapshot of a delta table, i.e. the most a full scan can read
+
+    :param path : delta table location
+    """
+    return spark.sql(f"DESCRIBE DETAIL delta.`{path}`").collect()[0]["sizeInBytes"]
 
 
 def write_delta_tables(table: str, database: str, df: DataFrame):
@@ -109,10 +244,85 @@ def write_delta_tables(table: str, database: str, df: DataFrame):
     :param database : glue database name
     :param df : spark dataframe
     """
-    df.write.format("delta").mode("overwrite").saveAsTable(f"{database}.{table}")
+    # The partial aggregate columns were added to tables that used to hold only averages
+    df.write.format("delta").mode("overwrite").option("overwriteSchema", "true").saveAsTable(f"{database}.{table}")
     logger.info(f"Table {table} successfully loaded to {database} database!!")
 
 
+def merge_partial_aggregates(table: str, database: str, changes_df: DataFrame):
+    """
+    Add signed partial aggregates to a gold table and recompute its derived metrics
+
+    Only the keys present in the changes are read back and rewritten; keys whose
+    count drops to zero are deleted.
+
+    :param table : gold table name
+    :param database : gold database name
+    :param changes_df : partial aggregates of the silver changes
+    """
+    key, metrics = GOLD_TABLES[table]
+    current_df = spark.table(f"{database}.{table}").select(key, *PARTIAL_COLUMNS)
+    combined_df = changes_df.alias('c').join(
+        current_df.alias('t'), F.col(f"c.{key}").eqNullSafe(F.col(f"t.{key}")), 'left'
+    ).select(
+        F.col(f"c.{key}").alias(key),
+        *[(F.coalesce(F.col(f"t.{column}"), F.lit(0)) + F.col(f"c.{column}")).alias(column) for column in PARTIAL_COLUMNS]
+    )
+    with_derived_metrics(combined_df, metrics).createOrReplaceTempView(f"{table}_updates")
+    spark.sql(f"""
+        MERGE INTO {database}.{table} AS target
+        USING {table}_updates AS source
+        ON target.{key} <=> source.{key}
+        WHEN MATCHED AND source.movie_count <= 0 THEN DELETE
+        WHEN MATCHED THEN UPDATE SET *
+        WHEN NOT MATCHED AND source.movie_count > 0 THEN INSERT *
+    """)
+    logger.info(f"Changes successfully merged into {database}.{table}!!")
+
+
+def tag_commits(silver_version: Optional[int]):
+    """
+    Record the silver version on the next gold commits, or stop tagging if None
+
+    :param silver_version : silver version the gold tables are being brought up to
+    """
+    if silver_version is None:
+        spark.conf.unset("spark.databricks.delta.commitInfo.userMetadata")
+    else:
+        spark.conf.set("spark.databricks.delta.commitInfo.userMetadata", f"{SILVER_VERSION_TAG}{silver_version}")
+
+
+def full_load(movies_table: str, silver_database: str, gold_database: str, silver_version: int) -> Dict:
+    """
+    Recompute every gold table from a fixed silver version
+
+    :param movies_table : silver table name
+    :param silver_database : silver database name
+    :param gold_database : gold database name
+    :param silver_version : silver version to read
+
+    :return stage timings in seconds
+    """
+    timings = {}
+    
+    # Read from silver layer, only the columns the metrics use
+    movies_df = read_delta_table(movies_table, silver_database, silver_version).select(*SOURCE_COLUMNS)
+    
+    # Generate metrics for every table in one pass
+    started = time.perf_counter()
+    partials = partial_aggregates(movies_df)
+    timings['aggregate'] = round(time.perf_counter() - started, 3)
+    
+    # Write to gold layer; each overwrite carries the silver version it reflects
+    tag_commits(silver_version)
+    for table, (_, metrics) in GOLD_TABLES.items():
+        started = time.perf_counter()
+        write_delta_tables(table, gold_database, with_derived_metrics(partials[table], metrics))
+        timings[table] = round(time.perf_counter() - started, 3)
+    tag_commits(None)
+    return timings
+
+
 def main():
     # Define table names and databases
     movies_table = 'movies_info'
@@ -120,20 +330,58 @@ def main():
     silver_database = 'oakvale_silver'
     gold_database = 'oakvale_gold'
     
-    # Read from silver layer
-    movies_df = read_delta_table(movies_table, silver_database)
+    silver_path = delta_path(movies_table, silver_database)
+    report = {'mode': ingest_mode, 'silver_size_bytes': table_size_bytes(silver_path)}
+    if ingest_mode != 'incremental':
+        report['silver_version'] = latest_version(silver_path)
+        report['stage_seconds'] = full_load(movies_table, silver_database, gold_database, report['silver_version'])
+        logger.info(f"Gold run report: {json.dumps(report)}")
+        return
+    
+    # Versions written before the feed was enabled have no change data, so they need a full load
+    feed_enabled_now = enable_change_data_feed(silver_path)
+    silver_version = latest_version(silver_path)
+    report['silver_version'] = silver_version
+    processed = {table: processed_silver_version(table, gold_database) for table in GOLD_TABLES}
+    
+    # A run that stopped between tables leaves them at different versions; rebuilding is the safe fix
+    if feed_enabled_now or None in processed.values() or len(set(processed.values())) > 1:
+        logger.info(f"Loading gold in full from silver version {silver_version} (processed: {processed})")
+        report.update(mode='full', stage_seconds=full_load(movies_table, silver_database, gold_database, silver_version))
+        logger.info(f"Gold run report: {json.dumps(report)}")
+        return
+    last_version = next(iter(processed.values()))
+    if last_version >= silver_version:
+        logger.info(f"Gold is up to date with silver version {silver_version}")
+        return
     
-    # Generate metrics
-    genre_metrics_df = genre_metrics(movies_df)
-    studio_metrics_df = studio_metrics(movies_df)
-    year_metrics_df = year_metrics(movies_df)
+    # Read only the silver rows changed since the last run
+    try:
+        changes_df = read_silver_changes(silver_path, last_version + 1, silver_version).cache()
+        change_count = changes_df.count()
+    except Exception as e:
+        logger.warning(f"Cannot read silver changes {last_version + 1}-{silver_version}, loading in full: {e}")
+        report.update(mode='full', stage_seconds=full_load(movies_table, silver_database, gold_database, silver_version))
+        logger.info(f"Gold run report: {json.dumps(report)}")
+        return
+    logger.info(f"Folding {change_count} changed silver rows from versions {last_version + 1}-{silver_version}")
+    report['changed_rows'] = change_count
     
-    # Write to gold layer
-    write_delta_tables("genre_metrics", gold_database, genre_metrics_df)
-    write_delta_tables("studio_metrics", gold_database, studio_metrics_df)
-    write_delta_tables("year_metrics", gold_database, year_metrics_df)
+    # One aggregation for all tables; each merge is one commit tagged with the silver version
+    timings = {}
+    started = time.perf_counter()
+    partials = partial_aggregates(changes_df)
+    timings['aggregate'] = round(time.perf_counter() - started, 3)
+    tag_commits(silver_version)
+    for table in GOLD_TABLES:
+        started = time.perf_counter()
+        merge_partial_aggregates(table, gold_database, partials[table])
+        timings[table] = round(time.perf_counter() - started, 3)
+    tag_commits(None)
+    report['stage_seconds'] = timings
+    logger.info(f"Gold run report: {json.dumps(report)}")
 
 
 if __name__ == '__main__':
     main()
-    job.commit() 
\ No newline at end of file
+    job.commit()
@@ -1,13 +1,21 @@
 import sys
+from typing import Optional
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
 from pyspark.sql import DataFrame
 from pyspark.sql import functions as F
+from pyspark.sql.window import Window
 import logging
 
 args = getResolvedOptions(sys.argv, ['JOB_NAME'])
+
+# 'full' rebuilds silver from all of bronze, 'incremental' merges only new bronze changes
+ingest_mode = 'full'
+if '--INGEST_MODE' in sys.argv:
+    ingest_mode = getResolvedOptions(sys.argv, ['INGEST_MODE'])['INGEST_MODE']
+
 sc = SparkContext()
 glueContext = GlueContext(sc)
 
@@ -32,21 +40,108 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Silver table property holding the last bronze version merged into silver
+BRONZE_VERSION_PROPERTY = "oakvale.bronze_version"
+
+
+def delta_path(table: str, database: str) -> str:
+    return f"s3://oakvale-lakehouse/lakehouse/{database}/{table}"
 
-def read_delta_table(table: str, database: str) -> DataFrame:
+
+def read_delta_table(table: str, database: str, version: Optional[int] = None) -> DataFrame:
     """
     Read delta table stored in s3
 
     :param table : the table name
     :param database : the database name
+    :param version : table version to read, latest if None
     """
-    df = spark.read.format('delta').load(
-        f"s3://oakvale-lakehouse/lakehouse/{database}/{table}"
-    )
+    reader = spark.read.format('delta')
+    if version is not None:
+        reader = reader.option("versionAsOf", version)
+    df = reader.load(delta_path(table, database))
     logger.info(f"Table {database}.{table} successfully loaded from delta lake!!")
     return df
 
 
+def latest_version(path: str) -> int:
+    """
+    Latest committed version of a delta table
+
+    :param path : delta table location
+    """
+    return spark.sql(f"DESCRIBE HISTORY delta.`{path}` LIMIT 1").collect()[0]["version"]
+
+
+def enable_change_data_feed(path: str) -> bool:
+    """
+    Turn on the change data feed of a delta table if it is off
+
+    :param path : delta table location
+
+    :return True if the feed had to be enabled, i.e. earlier versions have no change data
+    """
+    properties = spark.sql(f"DESCRIBE DETAIL delta.`{path}`").collect()[0]["properties"] or {}
+    if properties.get("delta.enableChangeDataFeed", "false").lower() == "true":
+        return False
+    spark.sql(f"ALTER TABLE delta.`{path}` SET TBLPROPERTIES (delta.enableChangeDataFeed = true)")
+    logger.info(f"Enabled change data feed on {path}")
+    return True
+
+
+def processed_bronze_version(table: str, database: str) -> Optional[int]:
+    """
+    Last bronze version recorded on the silver table, None if silver has never been loaded
+
+    :param table : silver table name
+    :param database : silver database name
+    """
+    if not spark.catalog.tableExists(table, database):
+        return None
+    properties = {row.key: row.value for row in spark.sql(f"SHOW TBLPROPERTIES {database}.{table}").collect()}
+    version = properties.get(BRONZE_VERSION_PROPERTY)
+    return int(version) if version is not None else None
+
+
+def record_bronze_version(table: str, database: str, version: int):
+    """
+    Store the bronze version silver is now up to date with
+
+    :param table : silver table name
+    :param database : silver database name
+    :param version : bronze version that was processed
+    """
+    spark.sql(
+        f"ALTER TABLE {database}.{table} SET TBLPROPERTIES ('{BRONZE_VERSION_PROPERTY}' = '{version}')"
+    )
+
+
+def read_bronze_changes(path: str, start_version: int, end_version: int) -> DataFrame:
+    """
+    Rows inserted or updated in bronze between two versions, latest version per id
+
+    :param path : bronze delta table location
+    :param start_version : first version to read, inclusive
+    :param end_version : last version to read, inclusive
+
+    :return spark dataframe without the change data columns
+    """
+    changes_df = (
+        spark.read.format("delta")
+        .option("readChangeFeed", "true")
+        .option("startingVersion", start_version)
+        .option("endingVersion", end_version)
+        .load(path)
+        .where(F.col("_change_type").isin("insert", "update_postimage"))
+    )
+    latest = Window.partitionBy("id").orderBy(F.col("_commit_version").desc())
+    return (
+        changes_df.withColumn("_row", F.row_number().over(latest))
+        .where(F.col("_row") == 1)
+        .drop("_row", "_change_type", "_commit_version", "_commit_timestamp")
+    )
+
+
 def clean_movies_table(movies_df: DataFrame) -> DataFrame:
     """
     Clean movies info table: normalize rating, fix data types
@@ -92,10 +187,52 @@ def write_delta_tables(table: str, database: str, df: DataFrame):
     :param database : glue database name
     :param df : spark dataframe
     """
-    df.write.format("delta").mode("overwrite").saveAsTable(f"{database}.{table}")
+    # Bronze gains columns over time, so a rebuild may change the silver schema
+    df.write.format("delta").mode("overwrite").option("overwriteSchema", "true").saveAsTable(f"{database}.{table}")
     logger.info(f"Table {table} successfully loaded to {database} database!!")
 
 
+def merge_delta_table(table: str, database: str, df: DataFrame):
+    """
+    Upsert rows into a delta table on id
+
+    :param table : delta table name
+    :param database : glue database name
+    :param df : spark dataframe with at most one row per id
+    """
+    # New bronze columns are added to silver instead of failing the merge
+    spark.conf.set("spark.databricks.delta.schema.autoMerge.enabled", "true")
+    df.createOrReplaceTempView("silver_updates")
+    spark.sql(f"""
+        MERGE INTO {database}.{table} AS target
+        USING silver_updates AS source
+        ON target.id = source.id
+        WHEN MATCHED THEN UPDATE SET *
+        WHEN NOT MATCHED THEN INSERT *
+    """)
+    logger.info(f"Changes successfully merged into {database}.{table}!!")
+
+
+def full_load(movies_table: str, bronze_database: str, silver_database: str, bronze_version: int):
+    """
+    Rebuild silver from a fixed bronze version
+
+    :param movies_table : table name in both layers
+    :param bronze_database : bronze database name
+    :param silver_database : silver database name
+    :param bronze_version : bronze version to read
+    """
+    # Read from bronze layer
+    movies_df = read_delta_table(movies_table, bronze_database, bronze_version)
+    
+    # Clean data
+    movies_clean_df = clean_movies_table(movies_df)
+    
+    # Write to silver layer
+    write_delta_tables(movies_table, silver_database, movies_clean_df)
+    record_bronze_version(movies_table, silver_database, bronze_version)
+
+
 def main():
     # Define table names and databases
     movies_table = 'movies_info'
@@ -103,14 +240,37 @@ def main():
     bronze_database = 'oakvale_bronze'
     silver_database = 'oakvale_silver'
     
-    # Read from bronze layer
-    movies_df = read_delta_table(movies_table, bronze_database)
+    bronze_path = delta_path(movies_table, bronze_database)
+    if ingest_mode != 'incremental':
+        full_load(movies_table, bronze_database, silver_database, latest_version(bronze_path))
+        return
     
-    # Clean data
-    movies_clean_df = clean_movies_table(movies_df)
+    # Versions written before the feed was enabled have no change data, so they need a full load
+    feed_enabled_now = enable_change_data_feed(bronze_path)
+    bronze_version = latest_version(bronze_path)
+    last_version = processed_bronze_version(movies_table, silver_database)
+    if last_version is None or feed_enabled_now:
+        logger.info(f"Loading silver in full from bronze version {bronze_version}")
+        full_load(movies_table, bronze_database, silver_database, bronze_version)
+        return
+    if last_version >= bronze_version:
+        logger.info(f"Silver is up to date with bronze version {bronze_version}")
+        return
     
-    # Write to silver layer
-    write_delta_tables(movies_table, silver_database, movies_clean_df)
+    # Read only the bronze rows added since the last run; cached so the count and merge share one read
+    try:
+        changes_df = read_bronze_changes(bronze_path, last_version + 1, bronze_version).cache()
+        change_count = changes_df.count()
+    except Exception as e:
+        # e.g. the change data for those versions was vacuumed or the feed was off for a while
+        logger.warning(f"Cannot read bronze changes {last_version + 1}-{bronze_version}, loading in full: {e}")
+        full_load(movies_table, bronze_database, silver_database, bronze_version)
+        return
+    logger.info(f"Merging {change_count} changed ids from bronze versions {last_version + 1}-{bronze_version}")
+    
+    # Clean data and upsert into silver layer
+    merge_delta_table(movies_table, silver_database, clean_movies_table(changes_df))
+    record_bronze_version(movies_table, silver_database, bronze_version)
 
 
 if __name__ == '__main__':
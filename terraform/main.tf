@@ -285,14 +285,23 @@ locals {
     bronze = {
       name        = "bronze"
       script_name = "bronze_glue_script"
+      arguments   = {
+        "--INGEST_MODE" = "incremental"
+      }
     },
     silver = {
       name        = "silver"
       script_name = "silver_glue_script"
+      arguments   = {
+        "--INGEST_MODE" = "incremental"
+      }
     },
     gold = {
       name        = "gold"
       script_name = "gold_glue_script"
+      arguments   = {
+        "--INGEST_MODE" = "incremental"
+      }
     }
   }
 }
@@ -315,7 +324,7 @@ resource "aws_glue_job" "etl_jobs" {
     script_location = "s3://${aws_s3_bucket.oakvale_lakehouse_glue_bucket.bucket}/scripts/${each.value.script_name}.py"
   }
 
-  default_arguments = {
+  default_arguments = merge({
     "--job-language"                     = "python"
     "--enable-metrics"                   = "true"
     "--enable-continuous-cloudwatch-log" = "true"
@@ -327,7 +336,7 @@ resource "aws_glue_job" "etl_jobs" {
     "--source-path"                      = "s3://${aws_s3_bucket.oakvale_raw_bucket.bucket}/"
     "--destination-path"                 = "s3://${aws_s3_bucket.oakvale_lakehouse_bucket.bucket}/lakehouse/${each.value.name}/"
     "--job-name"                         = "oakvale-${each.value.name}-job"
-  }
+  }, each.value.arguments)
 
   execution_property {
     max_concurrent_runs = 1
@@ -502,9 +511,13 @@ resource "aws_lambda_function" "adzuna_job_extractor" {
       DYNAMODB_STATE_TABLE = aws_dynamodb_table.adzuna_pipeline_state.name
       GLUE_DATABASE        = "job_data_lake"
       GLUE_TABLE           = "adzuna_jobs"
+      ADZUNA_COUNTRY       = "ca"
       SEARCH_PHRASE        = "data engineer"
       OVERLAP_HOURS        = "12"
       BATCH_SIZE           = "1000"
+      FETCH_CONCURRENCY    = "4"
+      PARQUET_FLUSH_ROWS   = "100000"
+      PARQUET_FLUSH_MB     = "128"
     }
   }
 
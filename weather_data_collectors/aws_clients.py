@@ -0,0 +1,51 @@
+import threading
+import time
+import boto3
+from typing import Callable, Dict
+
+# boto3 clients and resources built once per container and reused by warm invocations
+_registry = {}
+_timings = {}
+_lock = threading.Lock()
+
+
+def _lookup(kind: str, service: str, factory: Callable):
+    """Return the registered object for service, building it on first use"""
+    name = f"{kind}:{service}"
+    start = time.perf_counter()
+    with _lock:
+        created = name not in _registry
+        if created:
+            _registry[name] = factory(service)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        stats = _timings.setdefault(name, {'cold_init_ms': 0.0, 'warm_hits': 0, 'warm_ms': 0.0})
+        if created:
+            stats['cold_init_ms'] = round(elapsed_ms, 3)
+        else:
+            stats['warm_hits'] += 1
+            stats['warm_ms'] += elapsed_ms
+        return _registry[name]
+
+
+def get_client(service: str):
+    """Shared boto3 client for service"""
+    return _lookup('client', service, boto3.client)
+
+
+def get_resource(service: str):
+    """Shared boto3 resource for service"""
+    return _lookup('resource', service, boto3.resource)
+
+
+def init_timings() -> Dict:
+    """Cold construction time and warm lookup cost of every registered client"""
+    with _lock:
+        return {
+            name: {
+                'cold_init_ms': stats['cold_init_ms'],
+                'warm_hits': stats['warm_hits'],
+                'warm_avg_ms': round(stats['warm_ms'] / stats['warm_hits'], 3) if stats['warm_hits'] else 0.0
+            }
+            for name, stats in _timings.items()
+        }
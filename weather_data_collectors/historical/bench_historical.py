@@ -0,0 +1,103 @@
+"""Times a historical backfill against a local fake archive server.
+
+Sweeps max_workers, months_per_request and min_request_interval and prints the
+API requests, peak concurrent requests and wall time of each combination.
+Results are written to an in-memory S3 stand-in. Set STUB_BASE_LATENCY_MS,
+STUB_MONTH_LATENCY_MS, BENCH_LOCATIONS, BENCH_YEARS_BACK and
+BENCH_REQUEST_INTERVALS to change the scenario. Run with
+
+    python bench_historical.py
+"""
+import logging
+import os
+import sys
+import time
+
+# Every request must reach the fake server, so the response cache is disabled before the client is built
+os.environ['HTTP_CACHE_ENABLED'] = 'false'
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_archive import FakeArchiveServer  # noqa: E402
+from historical_weather import HistoricalWeatherCollector  # noqa: E402
+
+WORKER_COUNTS = (1, 2, 4, 8)
+MONTHS_PER_REQUEST = (1, 3, 12)
+REQUEST_INTERVALS = tuple(float(value) for value in os.environ.get('BENCH_REQUEST_INTERVALS', '0.5').split(','))
+YEARS_BACK = int(os.environ.get('BENCH_YEARS_BACK', 3))
+LOCATION_COUNT = int(os.environ.get('BENCH_LOCATIONS', 3))
+
+
+class MemoryS3:
+    """The S3 calls the collector makes, kept in a dict"""
+    
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+    
+    def __init__(self):
+        self.objects = {}
+    
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+    
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+    
+    def get_object(self, Bucket, Key):
+        # No manifest, so every month is collected
+        raise self.exceptions.NoSuchKey(Key)
+    
+    def get_paginator(self, name):
+        return self
+    
+    def paginate(self, **kwargs):
+        return []
+
+
+def bench_locations(count):
+    return [
+        {
+            'slug': f"site{index}",
+            'name': f"Site {index}",
+            'latitude': -25.0 - index,
+            'longitude': 30.0 + index,
+            'timezone': 'Africa/Johannesburg'
+        }
+        for index in range(count)
+    ]
+
+
+def run(server, max_workers, months_per_request, min_request_interval):
+    collector = HistoricalWeatherCollector(
+        'bench-bucket', max_workers, min_request_interval, months_per_request, 'json',
+        locations=bench_locations(LOCATION_COUNT)
+    )
+    collector.s3_client = MemoryS3()
+    collector.api_base_url = server.url
+    server.reset()
+    start = time.perf_counter()
+    results = collector.collect_historical_data(YEARS_BACK, force_refresh=True)
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    base_latency = float(os.environ.get('STUB_BASE_LATENCY_MS', 150)) / 1000
+    latency_per_month = float(os.environ.get('STUB_MONTH_LATENCY_MS', 10)) / 1000
+    print(f"{YEARS_BACK} years, {LOCATION_COUNT} locations, stub latency {base_latency * 1000:.0f} ms "
+          f"+ {latency_per_month * 1000:.0f} ms per location-month")
+    print(f"{'interval':>8} {'months/req':>10} {'workers':>7} {'requests':>8} {'peak':>4} {'failed':>6} {'seconds':>8}")
+    with FakeArchiveServer(base_latency, latency_per_month) as server:
+        for min_request_interval in REQUEST_INTERVALS:
+            for months_per_request in MONTHS_PER_REQUEST:
+                for max_workers in WORKER_COUNTS:
+                    results, elapsed = run(server, max_workers, months_per_request, min_request_interval)
+                    print(f"{min_request_interval:>8.2f} {months_per_request:>10} {max_workers:>7} "
+                          f"{server.requests:>8} {server.peak_in_flight:>4} "
+                          f"{len(results['failed_months']):>6} {elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
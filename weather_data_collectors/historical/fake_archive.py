@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeArchiveServer:
+    """Local stand-in for the Open-Meteo archive endpoint, for benchmarks only
+    
+    Answers daily requests for any number of comma separated coordinates with
+    constant values. Each response is delayed by base_latency plus
+    latency_per_month for every location-month in the requested range, so longer
+    ranges cost more, as they do upstream. Counts requests and the peak number
+    in flight at once.
+    """
+    
+    def __init__(self, base_latency: float = 0.15, latency_per_month: float = 0.01):
+        self.base_latency = base_latency
+        self.latency_per_month = latency_per_month
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+    
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/v1/archive"
+    
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.peak_in_flight = 0
+    
+    def response(self, query: dict) -> list:
+        start = date.fromisoformat(query['start_date'][0])
+        end = date.fromisoformat(query['end_date'][0])
+        days = [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+        daily = {'time': days}
+        for param in query.get('daily', []):
+            daily[param] = [1.5] * len(days)
+        return [{'daily': daily, 'utc_offset_seconds': 7200} for _ in query['latitude'][0].split(',')]
+    
+    def handler(self):
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                with fake.lock:
+                    fake.requests += 1
+                    fake.in_flight += 1
+                    fake.peak_in_flight = max(fake.peak_in_flight, fake.in_flight)
+                try:
+                    responses = fake.response(query)
+                    months = len(responses[0]['daily']['time']) / 30.4
+                    time.sleep(fake.base_latency + fake.latency_per_month * months * len(responses))
+                    body = json.dumps(responses if len(responses) > 1 else responses[0]).encode()
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        
+        return Handler
+    
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
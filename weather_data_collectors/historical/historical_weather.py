@@ -1,29 +1,83 @@
 import json
-import boto3
+import threading
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from tenacity import retry, stop_after_attempt, wait_exponential
 import logging
 import os
+from aws_clients import get_client, init_timings
+from http_client import get_http_client
+from locations import load_locations
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# A partition is kept in exactly one of these formats
+OUTPUT_FORMATS = ('json', 'parquet')
+
+class RequestThrottle:
+    """Spaces out request start times across threads to stay under the API rate limit"""
+    
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self.next_request_at = 0.0
+        self.lock = threading.Lock()
+    
+    def wait(self):
+        """Block until this caller may start its request"""
+        with self.lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_request_at)
+            self.next_request_at = start_at + self.min_interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
 class HistoricalWeatherCollector:
     """Collects historical weather data from Open-Meteo API"""
     
-    def __init__(self, s3_bucket: str):
-        self.s3_client = boto3.client('s3')
+    def __init__(self, s3_bucket: str, max_workers: int = 4, min_request_interval: float = 0.5,
+                 months_per_request: int = 12, output_format: str = 'json',
+                 locations: Optional[List[Dict]] = None):
+        self.s3_client = get_client('s3')
         self.s3_bucket = s3_bucket
+        
+        # 'json' keeps the original row documents, 'parquet' writes flat typed columns
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.output_format = output_format
         self.api_base_url = "https://archive-api.open-meteo.com/v1/archive"
         
-        # Nelspruit coordinates
-        self.latitude = -25.4753
-        self.longitude = 30.9698
-        self.location_name = "Nelspruit, Mpumalanga, South Africa"
+        # Shared pooled session; settled archive ranges never change, so they are cached for longer
+        self.http = get_http_client()
+        self.settled_cache_ttl = int(os.environ.get('HISTORICAL_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+        self.recent_cache_ttl = 3600
+        
+        # Concurrency settings; the throttle is shared by all worker threads
+        self.max_workers = max(1, max_workers)
+        self.throttle = RequestThrottle(min_request_interval)
+        
+        # The archive endpoint accepts any date range, so several months share one request
+        self.months_per_request = max(1, months_per_request)
+        
+        # Completeness of each saved month partition, keyed by "<location>/YYYY-MM"
+        self.manifest_key = "manifests/historical_manifest.json"
+        self.manifest = {}
+        self.manifest_lock = threading.Lock()
+        
+        # ERA5 data lags real time by a few days, so recent days come back empty
+        self.archive_delay_days = 7
+        
+        # Locations are fetched together with comma separated coordinates
+        self.locations = locations or load_locations()
         
         # API parameters
         self.weather_params = [
@@ -44,85 +98,147 @@ class HistoricalWeatherCollector:
         ]
     
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def fetch_historical_data(self, start_date: str, end_date: str) -> Dict:
-        """Fetch historical weather data with retry mechanism"""
+    def fetch_historical_data(self, start_date: str, end_date: str) -> List[Dict]:
+        """Fetch historical weather data for every location with retry mechanism
+        
+        Returns one response per location, in registry order.
+        """
         try:
             params = {
-                'latitude': self.latitude,
-                'longitude': self.longitude,
+                'latitude': ','.join(str(location['latitude']) for location in self.locations),
+                'longitude': ','.join(str(location['longitude']) for location in self.locations),
                 'start_date': start_date,
                 'end_date': end_date,
                 'daily': self.weather_params,
-                'timezone': 'Africa/Johannesburg'
+                'timezone': ','.join(location['timezone'] for location in self.locations)
             }
             
-            response = requests.get(self.api_base_url, params=params, timeout=30)
-            response.raise_for_status()
+            # Ranges reaching into the archive delay are still being filled in upstream
+            settled_before = (datetime.now() - timedelta(days=self.archive_delay_days)).strftime('%Y-%m-%d')
+            ttl = self.settled_cache_ttl if end_date < settled_before else self.recent_cache_ttl
+            
+            # The throttle only applies when the request is not served from the cache
+            data = self.http.get_json(self.api_base_url, params, ttl, timeout=30, before_request=self.throttle.wait)
             
-            return response.json()
+            # A single coordinate pair returns an object, several return a list
+            responses = data if isinstance(data, list) else [data]
+            if len(responses) != len(self.locations):
+                raise ValueError(f"Expected {len(self.locations)} location responses, got {len(responses)}")
+            return responses
             
         except requests.exceptions.RequestException as e:
             logger.error(f"API request failed: {str(e)}")
             raise
     
-    def process_monthly_data(self, raw_data: Dict, year: int, month: int) -> List[Dict]:
-        """Process raw API data into structured format"""
-        if not raw_data or 'daily' not in raw_data:
-            return []
+    def build_daily_table(self, raw_data: Dict, location: Dict,
+                          collected_at: Optional[datetime] = None) -> pa.Table:
+        """Convert the API's daily arrays into a typed column table in one step
+        
+        Location and metadata fields are constant per response, so they are stored
+        once as dictionary encoded columns and collected_at is stamped per batch.
+        """
+        daily = (raw_data or {}).get('daily') or {}
+        dates = pa.array(daily.get('time', []), pa.string())
+        num_rows = len(dates)
+        collected_at = collected_at or datetime.utcnow()
         
-        daily = raw_data['daily']
-        processed_data = []
+        def constant(value, type_=pa.string()):
+            return pa.repeat(pa.scalar(value, type_), num_rows)
         
-        for i, date in enumerate(daily.get('time', [])):
-            # Create data point for each day
-            data_point = {
-                'date': date,
+        columns = {
+            'date': pc.strptime(dates, format='%Y-%m-%d', unit='s').cast(pa.date32()),
+            'location_name': constant(location['name']).dictionary_encode(),
+            'latitude': constant(location['latitude'], pa.float64()),
+            'longitude': constant(location['longitude'], pa.float64())
+        }
+        for param in self.weather_params:
+            values = daily.get(param)
+            columns[param] = pa.array(values, pa.float64()) if values is not None else constant(None, pa.float64())
+        columns['data_source'] = constant('open_meteo_historical').dictionary_encode()
+        columns['api_version'] = constant('v1').dictionary_encode()
+        columns['collected_at'] = constant(collected_at, pa.timestamp('us'))
+        
+        return pa.table(columns)
+    
+    def to_records(self, table: pa.Table, year: int, month: int) -> List[Dict]:
+        """Row-dict compatibility view of a daily table, in the original JSON layout"""
+        return [
+            {
+                'date': row['date'].isoformat(),
                 'year': year,
                 'month': month,
                 'location': {
-                    'name': self.location_name,
-                    'latitude': self.latitude,
-                    'longitude': self.longitude
+                    'name': row['location_name'],
+                    'latitude': row['latitude'],
+                    'longitude': row['longitude']
                 },
-                'weather': {}
+                'weather': {param: row[param] for param in self.weather_params},
+                'metadata': {
+                    'data_source': row['data_source'],
+                    'api_version': row['api_version'],
+                    'collected_at': row['collected_at'].isoformat()
+                }
             }
-            
-            # Add all weather parameters
-            for param in self.weather_params:
-                if param in daily:
-                    data_point['weather'][param] = daily[param][i]
-            
-            # Add metadata
-            data_point['metadata'] = {
-                'data_source': 'open_meteo_historical',
-                'api_version': 'v1',
-                'collected_at': datetime.utcnow().isoformat()
-            }
-            
-            processed_data.append(data_point)
+            for row in table.to_pylist()
+        ]
+    
+    def process_monthly_data(self, raw_data: Dict, year: int, month: int,
+                             location: Optional[Dict] = None) -> List[Dict]:
+        """Process raw API data into structured format"""
+        if not raw_data or 'daily' not in raw_data:
+            return []
         
-        return processed_data
+        return self.to_records(self.build_daily_table(raw_data, location or self.locations[0]), year, month)
+    
+    def partition_key(self, location: Dict, year: int, month: int) -> str:
+        """S3 key of a location's month partition in the configured output format"""
+        return (
+            f"historical/location={location['slug']}/year={year}/month={month:02d}/"
+            f"weather_data.{self.output_format}"
+        )
     
-    def save_to_s3(self, data: List[Dict], year: int, month: int) -> bool:
-        """Save processed data to S3 with year/month partitioning"""
+    def remove_other_formats(self, s3_key: str):
+        """Delete the partition's object in any other output format, so a prefix never mixes formats"""
+        stem = s3_key.rsplit('.', 1)[0]
+        for output_format in OUTPUT_FORMATS:
+            if output_format != self.output_format:
+                self.s3_client.delete_object(Bucket=self.s3_bucket, Key=f"{stem}.{output_format}")
+    
+    def to_parquet(self, table: pa.Table) -> bytes:
+        """Write a daily table as a compressed Parquet file
+        
+        year/month are not table columns; they are left to the partition path.
+        """
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink, compression='snappy')
+        return sink.getvalue().to_pybytes()
+    
+    def save_to_s3(self, table: pa.Table, location: Dict, year: int, month: int) -> bool:
+        """Save processed data to S3 with location/year/month partitioning"""
         try:
-            if not data:
-                logger.warning(f"No data to save for {year}-{month:02d}")
+            if table is None or table.num_rows == 0:
+                logger.warning(f"No data to save for {location['slug']} {year}-{month:02d}")
                 return False
             
-            # Create S3 key with year/month partitioning
-            s3_key = f"historical/year={year}/month={month:02d}/weather_data.json"
+            # Create S3 key with location/year/month partitioning
+            s3_key = self.partition_key(location, year, month)
             
-            # Convert to JSON with proper formatting
-            json_data = json.dumps(data, indent=2)
+            if self.output_format == 'parquet':
+                body = self.to_parquet(table)
+                content_type = 'application/vnd.apache.parquet'
+            else:
+                # Convert to JSON with proper formatting
+                body = json.dumps(self.to_records(table, year, month), indent=2)
+                content_type = 'application/json'
             
             # Upload to S3
             self.s3_client.put_object(
                 Bucket=self.s3_bucket,
                 Key=s3_key,
-                Body=json_data,
-                ContentType='application/json'
+                Body=body,
+                ContentType=content_type
             )
+            self.remove_other_formats(s3_key)
             
             logger.info(f"Successfully saved data to s3://{self.s3_bucket}/{s3_key}")
             return True
@@ -131,47 +247,179 @@ class HistoricalWeatherCollector:
             logger.error(f"Failed to save data to S3: {str(e)}")
             return False
     
-    def collect_monthly_data(self, year: int, month: int) -> bool:
-        """Collect and save data for a specific month"""
+    def load_manifest(self) -> Dict:
+        """Load the partition manifest, rebuilding it from the S3 listing if it is missing"""
         try:
-            # Calculate date range for the month
-            start_date = datetime(year, month, 1)
-            if month == 12:
-                end_date = datetime(year + 1, 1, 1) - timedelta(days=1)
-            else:
-                end_date = datetime(year, month + 1, 1) - timedelta(days=1)
-            
-            # Don't fetch future data
-            current_date = datetime.now()
-            if start_date > current_date:
+            response = self.s3_client.get_object(Bucket=self.s3_bucket, Key=self.manifest_key)
+            self.manifest = json.loads(response['Body'].read())
+            legacy = sum(1 for name in self.manifest if '/' not in name)
+            if legacy:
+                logger.warning(f"{legacy} manifest entries predate location partitions and will be refetched; "
+                               f"run migrate_location_partitions.py to keep them")
+            return self.manifest
+        except self.s3_client.exceptions.NoSuchKey:
+            logger.info("No partition manifest found, falling back to S3 listing")
+        
+        # Without a manifest we only know when each object was written; a month
+        # written well after it ended is treated as complete
+        self.manifest = {}
+        legacy_keys = 0
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.s3_bucket, Prefix='historical/'):
+            for obj in page.get('Contents', []):
+                parts = dict(part.split('=', 1) for part in obj['Key'].split('/') if '=' in part)
+                if not {'location', 'year', 'month'} <= set(parts):
+                    legacy_keys += 'location' not in parts
+                    continue
+                year, month = int(parts['year']), int(parts['month'])
+                _, month_end = self.month_bounds(year, month)
+                written_at = obj['LastModified'].replace(tzinfo=None)
+                if written_at >= month_end + timedelta(days=self.archive_delay_days):
+                    self.manifest[f"{parts['location']}/{year}-{month:02d}"] = {
+                        'key': obj['Key'],
+                        'day_count': month_end.day,
+                        'last_date': month_end.strftime('%Y-%m-%d')
+                    }
+        if legacy_keys:
+            logger.warning(f"{legacy_keys} objects under historical/ predate location partitions and will be "
+                           f"refetched; run migrate_location_partitions.py to keep them")
+        return self.manifest
+    
+    def save_manifest(self):
+        """Persist the partition manifest next to the data"""
+        self.s3_client.put_object(
+            Bucket=self.s3_bucket,
+            Key=self.manifest_key,
+            Body=json.dumps(self.manifest, indent=2, sort_keys=True),
+            ContentType='application/json'
+        )
+    
+    def record_partition(self, table: pa.Table, location: Dict, year: int, month: int):
+        """Record how many days of a saved month actually carry weather values"""
+        has_data = pc.is_valid(table[self.weather_params[0]])
+        for param in self.weather_params[1:]:
+            has_data = pc.or_(has_data, pc.is_valid(table[param]))
+        last_date = pc.max(table['date'].filter(has_data)).as_py()
+        with self.manifest_lock:
+            self.manifest[f"{location['slug']}/{year}-{month:02d}"] = {
+                'key': self.partition_key(location, year, month),
+                'day_count': pc.sum(has_data.cast(pa.int32())).as_py() or 0,
+                'last_date': last_date.isoformat() if last_date else None,
+                'updated_at': datetime.utcnow().isoformat()
+            }
+    
+    def is_month_complete(self, year: int, month: int) -> bool:
+        """A month is complete once every day has been saved with data for every location
+        
+        Months saved in another output format are not complete, so they are rewritten in this one.
+        """
+        _, month_end = self.month_bounds(year, month)
+        for location in self.locations:
+            entry = self.manifest.get(f"{location['slug']}/{year}-{month:02d}")
+            if not entry or entry.get('key') != self.partition_key(location, year, month):
+                return False
+            if entry.get('day_count') != month_end.day or entry.get('last_date') != month_end.strftime('%Y-%m-%d'):
+                return False
+        return True
+    
+    @staticmethod
+    def month_bounds(year: int, month: int) -> Tuple[datetime, datetime]:
+        """Return the first and last day of a calendar month"""
+        start_date = datetime(year, month, 1)
+        end_date = start_date + relativedelta(months=1) - timedelta(days=1)
+        return start_date, end_date
+    
+    def plan_ranges(self, months: List[Tuple[int, int]]) -> List[List[Tuple[int, int]]]:
+        """Group consecutive calendar months into ranges of at most months_per_request"""
+        ranges = []
+        for year, month in sorted(months):
+            current = ranges[-1] if ranges else None
+            if current and len(current) < self.months_per_request:
+                last_year, last_month = current[-1]
+                if (year, month) == ((last_year, last_month + 1) if last_month < 12 else (last_year + 1, 1)):
+                    current.append((year, month))
+                    continue
+            ranges.append([(year, month)])
+        return ranges
+    
+    @staticmethod
+    def split_by_month(table: pa.Table) -> Dict[Tuple[int, int], pa.Table]:
+        """Split a multi-month daily table into one table per calendar month"""
+        month_keys = pc.add(pc.multiply(pc.year(table['date']), 100), pc.month(table['date']))
+        return {
+            (key // 100, key % 100): table.filter(pc.equal(month_keys, key))
+            for key in pc.unique(month_keys).to_pylist()
+        }
+    
+    def collect_range(self, months: List[Tuple[int, int]]) -> Dict[Tuple[int, int], bool]:
+        """Fetch consecutive months for all locations with a single API call
+        
+        Each location's month is saved to its own partition; a month succeeds only
+        if it was saved for every location.
+        """
+        outcomes = {}
+        
+        # Don't fetch future data
+        current_date = datetime.now()
+        for year, month in months:
+            if self.month_bounds(year, month)[0] > current_date:
                 logger.info(f"Skipping future month: {year}-{month:02d}")
-                return True
-            if end_date > current_date:
-                end_date = current_date
-            
-            logger.info(f"Collecting data for {year}-{month:02d}")
+                outcomes[(year, month)] = True
+        to_fetch = [ym for ym in months if ym not in outcomes]
+        if not to_fetch:
+            return outcomes
+        
+        start_date = self.month_bounds(*to_fetch[0])[0]
+        end_date = min(self.month_bounds(*to_fetch[-1])[1], current_date)
+        label = f"{to_fetch[0][0]}-{to_fetch[0][1]:02d}..{to_fetch[-1][0]}-{to_fetch[-1][1]:02d}"
+        
+        try:
+            logger.info(f"Collecting data for {label}")
             
             # Fetch data from API
-            raw_data = self.fetch_historical_data(
+            responses = self.fetch_historical_data(
                 start_date.strftime('%Y-%m-%d'),
                 end_date.strftime('%Y-%m-%d')
             )
-            
-            # Process and save data
-            processed_data = self.process_monthly_data(raw_data, year, month)
-            success = self.save_to_s3(processed_data, year, month)
-            
-            return success
-            
+            monthly_data = [
+                self.split_by_month(self.build_daily_table(raw_data, location))
+                for raw_data, location in zip(responses, self.locations)
+            ]
         except Exception as e:
-            logger.error(f"Failed to collect data for {year}-{month:02d}: {str(e)}")
-            return False
+            logger.error(f"Failed to collect data for {label}: {str(e)}")
+            outcomes.update({ym: False for ym in to_fetch})
+            return outcomes
+        
+        # Process and save each location's month into its own partition
+        for year, month in to_fetch:
+            outcomes[(year, month)] = True
+            for location, location_months in zip(self.locations, monthly_data):
+                try:
+                    month_table = location_months.get((year, month))
+                    saved = self.save_to_s3(month_table, location, year, month)
+                    if saved:
+                        self.record_partition(month_table, location, year, month)
+                except Exception as e:
+                    logger.error(f"Failed to collect data for {location['slug']} {year}-{month:02d}: {str(e)}")
+                    saved = False
+                outcomes[(year, month)] = outcomes[(year, month)] and saved
+        
+        return outcomes
     
-    def collect_historical_data(self, years_back: int = 3) -> Dict:
-        """Collect historical data for specified number of years"""
+    def collect_monthly_data(self, year: int, month: int) -> bool:
+        """Collect and save data for a specific month"""
+        return self.collect_range([(year, month)])[(year, month)]
+    
+    def collect_historical_data(self, years_back: int = 3, force_refresh: bool = False) -> Dict:
+        """Collect historical data for specified number of years
+        
+        Months the manifest already records as complete are skipped unless
+        force_refresh is set, so a daily run usually only refetches the current month.
+        """
         results = {
             'success_months': [],
             'failed_months': [],
+            'skipped_months': [],
             'total_months_processed': 0
         }
         
@@ -179,20 +427,41 @@ class HistoricalWeatherCollector:
         end_date = datetime.now()
         start_date = end_date - relativedelta(years=years_back)
         
+        months = []
         current_date = start_date
         while current_date <= end_date:
-            year = current_date.year
-            month = current_date.month
-            
-            success = self.collect_monthly_data(year, month)
-            
-            if success:
+            months.append((current_date.year, current_date.month))
+            current_date += relativedelta(months=1)
+        
+        self.load_manifest()
+        if not force_refresh:
+            results['skipped_months'] = [f"{y}-{m:02d}" for y, m in months if self.is_month_complete(y, m)]
+            months = [(y, m) for y, m in months if not self.is_month_complete(y, m)]
+        
+        # Collect ranges of months concurrently
+        outcomes = {}
+        ranges = self.plan_ranges(months)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for range_outcomes in executor.map(self.collect_range, ranges):
+                outcomes.update(range_outcomes)
+        
+        for year, month in months:
+            if outcomes.get((year, month)):
                 results['success_months'].append(f"{year}-{month:02d}")
             else:
                 results['failed_months'].append(f"{year}-{month:02d}")
             
             results['total_months_processed'] += 1
-            current_date += relativedelta(months=1)
+        
+        results['api_requests'] = len(ranges)
+        results['http_cache'] = self.http.metrics()
+        results['locations'] = [location['slug'] for location in self.locations]
+        
+        if results['success_months']:
+            try:
+                self.save_manifest()
+            except Exception as e:
+                logger.error(f"Failed to save partition manifest: {str(e)}")
         
         return results
 
@@ -207,16 +476,24 @@ def lambda_handler(event, context):
         
         # Get parameters from event
         years_back = event.get('years_back', 3)
+        force_refresh = bool(event.get('force_refresh', False))
+        max_workers = int(event.get('max_workers', os.environ.get('HISTORICAL_MAX_WORKERS', 4)))
+        min_request_interval = float(os.environ.get('OPEN_METEO_MIN_REQUEST_INTERVAL', 0.5))
+        months_per_request = int(event.get('months_per_request', os.environ.get('HISTORICAL_MONTHS_PER_REQUEST', 12)))
+        output_format = event.get('output_format', os.environ.get('WEATHER_OUTPUT_FORMAT', 'json'))
         
         # Create collector and run
-        collector = HistoricalWeatherCollector(s3_bucket)
-        results = collector.collect_historical_data(years_back)
+        collector = HistoricalWeatherCollector(
+            s3_bucket, max_workers, min_request_interval, months_per_request, output_format
+        )
+        results = collector.collect_historical_data(years_back, force_refresh)
         
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'Historical weather data collection completed',
-                'results': results
+                'results': results,
+                'aws_clients': init_timings()
             })
         }
         
@@ -1,33 +1,52 @@
+import bisect
 import json
-import boto3
+import math
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Set
 from tenacity import retry, stop_after_attempt, wait_exponential
 import logging
 import os
 from dateutil import parser
+from aws_clients import get_client, init_timings
+from http_client import get_http_client
+from locations import load_locations
 import pytz
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# A partition is kept in exactly one of these formats
+OUTPUT_FORMATS = ('json', 'parquet')
+
 class HourlyWeatherCollector:
     """Collects current weather data from Open-Meteo API"""
     
-    def __init__(self, s3_bucket: str):
-        self.s3_client = boto3.client('s3')
+    def __init__(self, s3_bucket: str, output_format: str = 'json', locations: Optional[List[Dict]] = None,
+                 fill_gaps: bool = False, max_workers: int = 8):
+        self.s3_client = get_client('s3')
         self.s3_bucket = s3_bucket
+        
+        # With fill_gaps every past hour of the returned window missing from S3 is written
+        self.fill_gaps = fill_gaps
+        self.max_workers = max_workers
+        
+        # 'json' keeps the original documents, 'parquet' writes flat typed columns
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.output_format = output_format
         self.api_base_url = "https://api.open-meteo.com/v1/forecast"
         
-        # Nelspruit coordinates
-        self.latitude = -25.4753
-        self.longitude = 30.9698
-        self.location_name = "Nelspruit, Mpumalanga, South Africa"
+        # Shared pooled session; retried or back-to-back runs reuse the cached forecast
+        self.http = get_http_client()
+        self.cache_ttl = int(os.environ.get('HOURLY_CACHE_TTL_SECONDS', 600))
         
-        # Set timezone
-        self.timezone = pytz.timezone('Africa/Johannesburg')
+        # Locations are fetched together with comma separated coordinates
+        self.locations = locations or load_locations()
         
         # API parameters
         self.hourly_params = [
@@ -46,33 +65,76 @@ class HourlyWeatherCollector:
         ]
     
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def fetch_current_weather(self) -> Dict:
-        """Fetch current weather data with retry mechanism"""
+    def fetch_current_weather(self) -> List[Dict]:
+        """Fetch current weather data for every location with retry mechanism
+        
+        Returns one response per location, in registry order.
+        """
         try:
             params = {
-                'latitude': self.latitude,
-                'longitude': self.longitude,
+                'latitude': ','.join(str(location['latitude']) for location in self.locations),
+                'longitude': ','.join(str(location['longitude']) for location in self.locations),
                 'hourly': ','.join(self.hourly_params),
-                'timezone': 'Africa/Johannesburg',
+                'timezone': ','.join(location['timezone'] for location in self.locations),
                 'forecast_days': 1,
                 'past_days': 1  # Include past day to ensure we have current data
             }
             
             logger.info(f"Requesting weather data with params: {params}")
-            response = requests.get(self.api_base_url, params=params, timeout=30)
-            response.raise_for_status()
+            data = self.http.get_json(self.api_base_url, params, self.cache_ttl, timeout=30)
             
-            data = response.json()
-            logger.info(f"API response received with {len(data.get('hourly', {}).get('time', []))} time points")
+            # A single coordinate pair returns an object, several return a list
+            responses = data if isinstance(data, list) else [data]
+            if len(responses) != len(self.locations):
+                raise ValueError(f"Expected {len(self.locations)} location responses, got {len(responses)}")
+            for location, location_data in zip(self.locations, responses):
+                time_points = len(location_data.get('hourly', {}).get('time', []))
+                logger.info(f"API response for {location['slug']} received with {time_points} time points")
             
-            return data
+            return responses
             
         except requests.exceptions.RequestException as e:
             logger.error(f"API request failed: {str(e)}")
             raise
     
-    def process_current_weather(self, raw_data: Dict) -> Optional[Dict]:
-        """Process current hour's weather data"""
+    @staticmethod
+    def localize(api_time: datetime, local_timezone) -> datetime:
+        """Attach the location timezone to a wall-clock API time"""
+        if api_time.tzinfo is not None:
+            return api_time.astimezone(local_timezone)
+        return local_timezone.normalize(local_timezone.localize(api_time))
+    
+    def select_hour_index(self, times: List[str], target: datetime, local_timezone) -> int:
+        """Index of the latest API hour at or before target, else the earliest one after it
+        
+        The API normally returns a regular hourly grid, so the index is computed
+        from the first timestamp and only the two ends are parsed. A grid that
+        spans a UTC offset change is bisected over epoch seconds, and only an
+        unsorted grid falls back to a linear scan.
+        """
+        target_epoch = target.timestamp()
+        first = self.localize(parser.isoparse(times[0]), local_timezone)
+        last = self.localize(parser.isoparse(times[-1]), local_timezone)
+        
+        # Fast path: fixed one hour step with no offset change inside the window
+        if first.utcoffset() == last.utcoffset() and last - first == timedelta(hours=len(times) - 1):
+            index = math.floor((target_epoch - first.timestamp()) / 3600)
+            return min(max(index, 0), len(times) - 1)
+        
+        epochs = [self.localize(parser.isoparse(t), local_timezone).timestamp() for t in times]
+        if all(a < b for a, b in zip(epochs, epochs[1:])):
+            return max(bisect.bisect_right(epochs, target_epoch) - 1, 0)
+        
+        logger.warning("API times are not sorted, scanning for the closest hour")
+        past = [i for i, epoch in enumerate(epochs) if epoch <= target_epoch]
+        if past:
+            return max(past, key=lambda i: epochs[i])
+        return min(range(len(epochs)), key=lambda i: epochs[i])
+    
+    def process_current_weather(self, raw_data: Dict, location: Optional[Dict] = None) -> Optional[Dict]:
+        """Process current hour's weather data for one location"""
+        location = location or self.locations[0]
+        local_timezone = pytz.timezone(location['timezone'])
         if not raw_data or 'hourly' not in raw_data:
             logger.error("No hourly data in API response")
             return None
@@ -83,110 +145,154 @@ class HourlyWeatherCollector:
             logger.error("No time data in hourly response")
             return None
             
-        # Parse API times
-        try:
-            api_times = [parser.isoparse(t) for t in hourly['time']]
-            logger.info(f"API times range: {api_times[0]} to {api_times[-1]}")
-        except Exception as e:
-            logger.error(f"Failed to parse API times: {e}")
-            return None
-
-        # Get current time in South Africa timezone
+        # Get current time in the location's timezone
         now_utc = datetime.utcnow().replace(tzinfo=pytz.UTC)
-        now_local = now_utc.astimezone(self.timezone)
+        now_local = now_utc.astimezone(local_timezone)
         current_hour = now_local.replace(minute=0, second=0, microsecond=0)
         
+        logger.info(f"API times range: {hourly['time'][0]} to {hourly['time'][-1]}")
         logger.info(f"Current local time: {now_local}")
         logger.info(f"Looking for data at: {current_hour}")
 
-        # Find the closest available time (prefer current or most recent past hour)
-        closest_time = None
-        closest_index = None
-        min_diff = None
-        
-        for i, api_time in enumerate(api_times):
-            # Convert API time to local timezone for comparison
-            api_time_local = api_time.astimezone(self.timezone)
-            time_diff = abs((current_hour - api_time_local).total_seconds())
-            
-            # Prefer times that are at or before current time
-            if api_time_local <= current_hour:
-                if min_diff is None or time_diff < min_diff:
-                    min_diff = time_diff
-                    closest_time = api_time_local
-                    closest_index = i
-            # If no past times found, use future time as fallback
-            elif closest_time is None:
-                if min_diff is None or time_diff < min_diff:
-                    min_diff = time_diff
-                    closest_time = api_time_local
-                    closest_index = i
-
-        if closest_index is None:
-            logger.error("No suitable time found in API response")
+        # Find the current or most recent past hour (or the first future hour if none)
+        try:
+            closest_index = self.select_hour_index(hourly['time'], current_hour, local_timezone)
+            closest_time = self.localize(parser.isoparse(hourly['time'][closest_index]), local_timezone)
+        except Exception as e:
+            logger.error(f"Failed to parse API times: {e}")
             return None
 
         logger.info(f"Using data from: {closest_time} (index {closest_index})")
 
-        # Create weather data point
+        weather_data = self.build_record(hourly, closest_index, closest_time, location)
+        logger.info(f"Weather data processed successfully for {closest_time}")
+        return weather_data
+    
+    def process_hourly_window(self, raw_data: Dict, location: Optional[Dict] = None) -> List[Dict]:
+        """Process every hour of the response up to and including the current hour"""
+        location = location or self.locations[0]
+        local_timezone = pytz.timezone(location['timezone'])
+        if not raw_data or not raw_data.get('hourly', {}).get('time'):
+            logger.error("No hourly data in API response")
+            return []
+        
+        hourly = raw_data['hourly']
+        now_local = datetime.utcnow().replace(tzinfo=pytz.UTC).astimezone(local_timezone)
+        current_hour = now_local.replace(minute=0, second=0, microsecond=0)
+        
+        try:
+            current_index = self.select_hour_index(hourly['time'], current_hour, local_timezone)
+            records = [
+                self.build_record(hourly, index, self.localize(parser.isoparse(hourly['time'][index]), local_timezone), location)
+                for index in range(current_index + 1)
+            ]
+        except Exception as e:
+            logger.error(f"Failed to parse API times: {e}")
+            return []
+        
+        logger.info(f"Processed {len(records)} hours for {location['slug']} up to {records[-1]['timestamp']}")
+        return records
+    
+    def build_record(self, hourly: Dict, index: int, api_time: datetime, location: Dict) -> Dict:
+        """Build the weather document for one hour of the response"""
         weather_data = {
-            'timestamp': closest_time.isoformat(),
-            'date': closest_time.strftime('%Y-%m-%d'),
-            'hour': closest_time.hour,
+            'timestamp': api_time.isoformat(),
+            'date': api_time.strftime('%Y-%m-%d'),
+            'hour': api_time.hour,
             'location': {
-                'name': self.location_name,
-                'latitude': self.latitude,
-                'longitude': self.longitude
+                'name': location['name'],
+                'latitude': location['latitude'],
+                'longitude': location['longitude']
             },
             'weather': {},
             'metadata': {
                 'data_source': 'open_meteo_current',
                 'api_version': 'v1',
                 'collected_at': datetime.utcnow().isoformat(),
-                'local_timezone': 'Africa/Johannesburg'
+                'local_timezone': location['timezone']
             }
         }
 
         # Add all weather parameters
         for param in self.hourly_params:
-            if param in hourly and len(hourly[param]) > closest_index:
-                value = hourly[param][closest_index]
+            if param in hourly and len(hourly[param]) > index:
+                value = hourly[param][index]
                 weather_data['weather'][param] = value
                 logger.debug(f"Added {param}: {value}")
 
-        logger.info(f"Weather data processed successfully for {closest_time}")
         return weather_data
     
-    def save_to_s3(self, data: Dict) -> bool:
-        """Save current weather data to S3"""
+    def to_parquet(self, data: Dict) -> bytes:
+        """Flatten a processed record into a compressed single-row Parquet file
+        
+        Weather values become float columns and the constant location and metadata
+        fields are dictionary encoded. The hour is left to the partition path.
+        """
+        timestamp = datetime.fromisoformat(data['timestamp'])
+        columns = {
+            'timestamp': pa.array([timestamp.astimezone(pytz.UTC)], pa.timestamp('us', tz='UTC')),
+            'date': pa.array([timestamp.date()], pa.date32()),
+            'location_name': pa.array([data['location']['name']], pa.string()).dictionary_encode(),
+            'latitude': pa.array([data['location']['latitude']], pa.float64()),
+            'longitude': pa.array([data['location']['longitude']], pa.float64())
+        }
+        for param in self.hourly_params:
+            columns[param] = pa.array([data['weather'].get(param)], pa.float64())
+        for field in ('data_source', 'api_version', 'local_timezone'):
+            columns[field] = pa.array([data['metadata'][field]], pa.string()).dictionary_encode()
+        columns['collected_at'] = pa.array([datetime.fromisoformat(data['metadata']['collected_at'])], pa.timestamp('us'))
+        
+        sink = pa.BufferOutputStream()
+        pq.write_table(pa.table(columns), sink, compression='snappy')
+        return sink.getvalue().to_pybytes()
+    
+    def partition_key(self, data: Dict, location: Dict) -> str:
+        """S3 key of the hourly partition a record belongs to, in the location's local time"""
+        timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
+        timestamp_local = timestamp.astimezone(pytz.timezone(location['timezone']))
+        return (
+            f"current/location={location['slug']}/year={timestamp_local.year}/month={timestamp_local.month:02d}/"
+            f"day={timestamp_local.day:02d}/hour={timestamp_local.hour:02d}/weather_data.{self.output_format}"
+        )
+    
+    def other_format_keys(self, s3_key: str) -> List[str]:
+        """Keys of the same partition in the output formats not being written"""
+        stem = s3_key.rsplit('.', 1)[0]
+        return [f"{stem}.{output_format}" for output_format in OUTPUT_FORMATS if output_format != self.output_format]
+    
+    def save_to_s3(self, data: Dict, location: Optional[Dict] = None, known_keys: Optional[Set[str]] = None) -> bool:
+        """Save current weather data for one location to S3
+        
+        The same hour in another output format is deleted so a prefix never mixes formats;
+        with known_keys, only objects listed there are deleted.
+        """
         try:
             if not data:
                 logger.warning("No data to save")
                 return False
             
-            # Extract timestamp components
-            timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
-            # Convert to local timezone for partitioning
-            timestamp_local = timestamp.astimezone(self.timezone)
-            
-            year = timestamp_local.year
-            month = timestamp_local.month
-            day = timestamp_local.day
-            hour = timestamp_local.hour
-            
             # Create S3 key with time-based partitioning
-            s3_key = f"current/year={year}/month={month:02d}/day={day:02d}/hour={hour:02d}/weather_data.json"
+            location = location or self.locations[0]
+            s3_key = self.partition_key(data, location)
             
-            # Convert to JSON with proper formatting
-            json_data = json.dumps(data, indent=2)
+            if self.output_format == 'parquet':
+                body = self.to_parquet(data)
+                content_type = 'application/vnd.apache.parquet'
+            else:
+                # Convert to JSON with proper formatting
+                body = json.dumps(data, indent=2)
+                content_type = 'application/json'
             
             # Upload to S3
             self.s3_client.put_object(
                 Bucket=self.s3_bucket,
                 Key=s3_key,
-                Body=json_data,
-                ContentType='application/json'
+                Body=body,
+                ContentType=content_type
             )
+            for other_key in self.other_format_keys(s3_key):
+                if known_keys is None or other_key in known_keys:
+                    self.s3_client.delete_object(Bucket=self.s3_bucket, Key=other_key)
             
             logger.info(f"Successfully saved data to s3://{self.s3_bucket}/{s3_key}")
             return True
@@ -195,6 +301,44 @@ class HourlyWeatherCollector:
             logger.error(f"Failed to save data to S3: {str(e)}")
             return False
     
+    def existing_keys(self, keys: List[str]) -> Set[str]:
+        """List the day prefixes covering keys and return the ones already in S3"""
+        prefixes = sorted({key.rsplit('/hour=', 1)[0] + '/' for key in keys})
+        existing = set()
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for prefix in prefixes:
+            for page in paginator.paginate(Bucket=self.s3_bucket, Prefix=prefix):
+                existing.update(obj['Key'] for obj in page.get('Contents', []))
+        return existing
+    
+    def save_window_to_s3(self, records: List[Dict], location: Dict) -> Dict:
+        """Write the current hour plus every earlier hour of the window that is missing from S3
+        
+        S3 has no multi-object put, so the missing hours are uploaded concurrently.
+        The current hour is always rewritten, as in single-hour mode. Hours saved only in
+        another output format count as missing and are replaced.
+        """
+        keys = [self.partition_key(record, location) for record in records]
+        existing = self.existing_keys(keys)
+        pending = [
+            record for index, (record, key) in enumerate(zip(records, keys))
+            if key not in existing or index == len(records) - 1
+        ]
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            saved = list(executor.map(lambda record: self.save_to_s3(record, location, existing), pending))
+        
+        logger.info(
+            f"Saved {sum(saved)} of {len(pending)} pending hours for {location['slug']} "
+            f"({len(records) - len(pending)} already in S3)"
+        )
+        return {
+            'success': all(saved),
+            'hours_written': sum(saved),
+            'hours_failed': len(saved) - sum(saved),
+            'hours_skipped': len(records) - len(pending)
+        }
+    
     def collect_current_weather(self) -> Dict:
         """Main function to collect current weather data"""
         results = {
@@ -207,30 +351,55 @@ class HourlyWeatherCollector:
         try:
             logger.info("Starting weather data collection...")
             
-            # Fetch current weather
-            raw_data = self.fetch_current_weather()
-            
-            # Process data
-            processed_data = self.process_current_weather(raw_data)
+            # Fetch current weather for all locations in one request
+            responses = self.fetch_current_weather()
             
-            if processed_data:
-                # Save to S3
-                save_success = self.save_to_s3(processed_data)
-                
-                results.update({
-                    'success': save_success,
-                    'data_collected': True,
-                    'weather_timestamp': processed_data['timestamp']
-                })
+            location_results = {}
+            for location, raw_data in zip(self.locations, responses):
+                if self.fill_gaps:
+                    # Process and save every past hour of the window
+                    records = self.process_hourly_window(raw_data, location)
+                    if records:
+                        location_results[location['slug']] = self.save_window_to_s3(records, location)
+                        location_results[location['slug']]['weather_timestamp'] = records[-1]['timestamp']
+                        continue
+                    processed_data = None
+                else:
+                    # Process data
+                    processed_data = self.process_current_weather(raw_data, location)
                 
-                if save_success:
-                    logger.info("Weather data collection completed successfully")
+                if processed_data:
+                    # Save to S3
+                    save_success = self.save_to_s3(processed_data, location)
+                    location_results[location['slug']] = {
+                        'success': save_success,
+                        'weather_timestamp': processed_data['timestamp']
+                    }
+                    
+                    if not save_success:
+                        logger.error(f"Weather data collection failed during S3 save for {location['slug']}")
                 else:
-                    logger.error("Weather data collection failed during S3 save")
+                    logger.error(f"Failed to process weather data for {location['slug']}")
+                    location_results[location['slug']] = {
+                        'success': False,
+                        'error': "Failed to process weather data"
+                    }
+            
+            collected = [r for r in location_results.values() if 'weather_timestamp' in r]
+            results.update({
+                'success': all(r['success'] for r in location_results.values()),
+                'data_collected': bool(collected),
+                'locations': location_results,
+                'http_cache': self.http.metrics()
+            })
+            if collected:
+                results['weather_timestamp'] = collected[0]['weather_timestamp']
             else:
-                logger.error("Failed to process weather data")
                 results['error'] = "Failed to process weather data"
             
+            if results['success']:
+                logger.info("Weather data collection completed successfully")
+            
             return results
             
         except Exception as e:
@@ -252,15 +421,19 @@ def lambda_handler(event, context):
         
         logger.info(f"Starting weather collection for bucket: {s3_bucket}")
         
+        output_format = os.environ.get('WEATHER_OUTPUT_FORMAT', 'json')
+        fill_gaps = str((event or {}).get('fill_gaps', os.environ.get('HOURLY_FILL_GAPS', 'false'))).lower() == 'true'
+        
         # Create collector and run
-        collector = HourlyWeatherCollector(s3_bucket)
+        collector = HourlyWeatherCollector(s3_bucket, output_format, fill_gaps=fill_gaps)
         results = collector.collect_current_weather()
         
         return {
             'statusCode': 200 if results['success'] else 500,
             'body': json.dumps({
                 'message': 'Current weather data collection completed',
-                'results': results
+                'results': results,
+                'aws_clients': init_timings()
             })
         }
         
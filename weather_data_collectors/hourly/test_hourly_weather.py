@@ -0,0 +1,131 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+from dateutil import parser
+
+# The collector imports the shared modules that are copied next to it at build time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hourly_weather  # noqa: E402
+from hourly_weather import HourlyWeatherCollector  # noqa: E402
+
+
+@pytest.fixture
+def collector():
+    # Hour selection needs no S3 or HTTP client
+    return HourlyWeatherCollector.__new__(HourlyWeatherCollector)
+
+
+@pytest.fixture
+def bisect_calls(monkeypatch):
+    """Count bisect_right calls, i.e. selections that took the bisect path"""
+    calls = []
+    bisect_right = hourly_weather.bisect.bisect_right
+
+    def spy(*args, **kwargs):
+        calls.append(args)
+        return bisect_right(*args, **kwargs)
+
+    monkeypatch.setattr(hourly_weather.bisect, 'bisect_right', spy)
+    return calls
+
+
+def scan_hour_index(times, target, local_timezone):
+    """The original linear scan, with API times localized the same way as the collector"""
+    closest_time = None
+    closest_index = None
+    min_diff = None
+    for i, time_string in enumerate(times):
+        api_time_local = HourlyWeatherCollector.localize(parser.isoparse(time_string), local_timezone)
+        time_diff = abs((target - api_time_local).total_seconds())
+        if api_time_local <= target:
+            if min_diff is None or time_diff < min_diff:
+                min_diff = time_diff
+                closest_time = api_time_local
+                closest_index = i
+        elif closest_time is None:
+            if min_diff is None or time_diff < min_diff:
+                min_diff = time_diff
+                closest_time = api_time_local
+                closest_index = i
+    return closest_index
+
+
+def api_times(timezone_name, start_utc, hours=48, with_offset=False):
+    """Hourly UTC steps rendered as the API does: local wall time, without an offset by default"""
+    local_timezone = pytz.timezone(timezone_name)
+    times = []
+    for step in range(hours):
+        local = (start_utc + timedelta(hours=step)).astimezone(local_timezone)
+        times.append(local.isoformat(timespec='minutes') if with_offset else local.strftime('%Y-%m-%dT%H:%M'))
+    return times
+
+
+def current_hours(timezone_name, start_utc, hours=48):
+    """Every "current hour" target the collector can ask for, from before the window to after it"""
+    local_timezone = pytz.timezone(timezone_name)
+    targets = []
+    for minutes in range(-120, (hours + 2) * 60, 30):
+        now_local = (start_utc + timedelta(minutes=minutes)).astimezone(local_timezone)
+        targets.append(local_timezone.normalize(now_local.replace(minute=0, second=0, microsecond=0)))
+    return targets
+
+
+def assert_matches_scan(collector, timezone_name, times, start_utc):
+    local_timezone = pytz.timezone(timezone_name)
+    for target in current_hours(timezone_name, start_utc, len(times)):
+        expected = scan_hour_index(times, target, local_timezone)
+        assert collector.select_hour_index(times, target, local_timezone) == expected, target
+
+
+def test_regular_grid_uses_fast_path(collector, bisect_calls):
+    start_utc = datetime(2025, 6, 1, 22, tzinfo=pytz.UTC)
+    times = api_times('Africa/Johannesburg', start_utc)
+    assert_matches_scan(collector, 'Africa/Johannesburg', times, start_utc)
+    assert not bisect_calls
+
+
+def test_fixed_offset_zone(collector, bisect_calls):
+    start_utc = datetime(2025, 3, 8, 0, tzinfo=pytz.UTC)
+    times = api_times('Etc/GMT+5', start_utc)
+    assert_matches_scan(collector, 'Etc/GMT+5', times, start_utc)
+    assert not bisect_calls
+
+
+def test_spring_forward_gap(collector, bisect_calls):
+    # 02:00 does not exist in New York on 9 March 2025, so the grid jumps from 01:00 to 03:00
+    start_utc = datetime(2025, 3, 8, 5, tzinfo=pytz.UTC)
+    times = api_times('America/New_York', start_utc)
+    assert '2025-03-09T02:00' not in times
+    assert_matches_scan(collector, 'America/New_York', times, start_utc)
+    assert bisect_calls
+
+
+@pytest.mark.parametrize('with_offset', [False, True])
+def test_fall_back_repeated_hour(collector, bisect_calls, with_offset):
+    # 01:00 happens twice in New York on 2 November 2025
+    start_utc = datetime(2025, 11, 1, 4, tzinfo=pytz.UTC)
+    times = api_times('America/New_York', start_utc, with_offset=with_offset)
+    wall_times = [time_string[:16] for time_string in times]
+    assert wall_times.count('2025-11-02T01:00') == 2
+    assert_matches_scan(collector, 'America/New_York', times, start_utc)
+    # Naive repeated hours are not strictly increasing and fall back to the scan
+    assert bool(bisect_calls) == with_offset
+
+
+def test_lord_howe_half_hour_shift(collector, bisect_calls):
+    # Lord Howe moves from UTC+10:30 to UTC+11:00 on 5 October 2025
+    start_utc = datetime(2025, 10, 4, 0, tzinfo=pytz.UTC)
+    times = api_times('Australia/Lord_Howe', start_utc)
+    assert times[0].endswith(':30') and times[-1].endswith(':00')
+    assert_matches_scan(collector, 'Australia/Lord_Howe', times, start_utc)
+    assert bisect_calls
+
+
+def test_naive_api_times_are_local_wall_time():
+    local_timezone = pytz.timezone('Africa/Johannesburg')
+    localized = HourlyWeatherCollector.localize(parser.isoparse('2025-06-01T05:00'), local_timezone)
+    assert localized.isoformat() == '2025-06-01T05:00:00+02:00'
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Response bodies keyed by URL and parameters, kept on local disk with TTL and size-bound eviction
+    
+    Entries live in /tmp by default, so they survive warm Lambda invocations of the
+    same container. The least recently stored entries are evicted first.
+    """
+    
+    def __init__(self, directory: str = '/tmp/http_cache', max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+        
+        # Size and store time of every entry on disk, rebuilt when the container starts
+        self.index = {}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.json'):
+                self.index[name[:-5]] = (os.path.getsize(path), os.path.getmtime(path))
+    
+    @staticmethod
+    def key(url: str, params: Dict) -> str:
+        """Stable cache key for a request"""
+        return hashlib.sha256(json.dumps([url, params], sort_keys=True, default=str).encode()).hexdigest()
+    
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Stored entry for key, fresh or not, or None"""
+        with self.lock:
+            if key not in self.index:
+                return None
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            self.remove(key)
+            return None
+    
+    def put(self, key: str, body: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Store a response body with its validators, then evict down to the size bound"""
+        entry = json.dumps({
+            'stored_at': time.time(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'body': body
+        })
+        try:
+            tmp_path = f"{self.path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(entry)
+            os.replace(tmp_path, self.path(key))
+        except OSError as e:
+            logger.warning(f"Could not write cache entry: {e}")
+            return
+        with self.lock:
+            self.index[key] = (len(entry), time.time())
+            self.evict()
+    
+    def touch(self, key: str, entry: Dict):
+        """Restart the TTL of an entry the server confirmed is unchanged"""
+        self.put(key, entry['body'], entry.get('etag'), entry.get('last_modified'))
+    
+    def remove(self, key: str):
+        with self.lock:
+            self.index.pop(key, None)
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+    
+    def evict(self):
+        """Drop the oldest entries until the cache fits in max_bytes (caller holds the lock)"""
+        total = sum(size for size, _ in self.index.values())
+        for key, (size, _) in sorted(self.index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            del self.index[key]
+            total -= size
+            self.evictions += 1
+
+
+class WeatherHttpClient:
+    """Pooled HTTP session with a response cache for the Open-Meteo endpoints
+    
+    Fresh entries are served without a request. Stale entries that carry an ETag or
+    Last-Modified header are revalidated with a conditional request.
+    """
+    
+    def __init__(self, cache: Optional[ResponseCache] = None, pool_size: int = 10):
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'revalidated': 0, 'bytes_downloaded': 0}
+    
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] += amount
+    
+    def get_json(self, url: str, params: Dict, ttl: float, timeout: float = 30,
+                 before_request: Optional[Callable[[], None]] = None):
+        """GET url and decode the JSON body, using the cache for up to ttl seconds
+        
+        before_request runs only when the network is used, so cache hits skip
+        any rate limiting the caller applies. HTTP errors are raised as usual.
+        """
+        key = entry = None
+        if self.cache is not None and ttl > 0:
+            key = self.cache.key(url, params)
+            entry = self.cache.get(key)
+            if entry and time.time() - entry['stored_at'] < ttl:
+                self.count('hits')
+                return json.loads(entry['body'])
+        
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        
+        if before_request:
+            before_request()
+        response = self.session.get(url, params=params, timeout=timeout, headers=headers)
+        
+        if response.status_code == 304 and entry:
+            self.count('revalidated')
+            self.cache.touch(key, entry)
+            return json.loads(entry['body'])
+        
+        response.raise_for_status()
+        self.count('misses')
+        self.count('bytes_downloaded', len(response.content))
+        if key is not None:
+            self.cache.put(key, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.json()
+    
+    def metrics(self) -> Dict:
+        """Counters since the container started"""
+        with self.lock:
+            metrics = dict(self.counters)
+        lookups = metrics['hits'] + metrics['misses'] + metrics['revalidated']
+        metrics['hit_rate'] = round((metrics['hits'] + metrics['revalidated']) / lookups, 3) if lookups else 0.0
+        metrics['evictions'] = self.cache.evictions if self.cache is not None else 0
+        return metrics
+
+
+# One client per container, reused across warm invocations
+_client = None
+
+
+def get_http_client() -> WeatherHttpClient:
+    """Shared client configured from HTTP_CACHE_DIR and HTTP_CACHE_MAX_MB"""
+    global _client
+    if _client is None:
+        cache = None
+        if os.environ.get('HTTP_CACHE_ENABLED', 'true').lower() == 'true':
+            cache = ResponseCache(
+                os.environ.get('HTTP_CACHE_DIR', '/tmp/http_cache'),
+                int(os.environ.get('HTTP_CACHE_MAX_MB', 256)) * 1024 * 1024
+            )
+        _client = WeatherHttpClient(cache)
+    return _client
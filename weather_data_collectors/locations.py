@@ -0,0 +1,28 @@
+import json
+import os
+from typing import Dict, List
+
+# Locations collected when WEATHER_LOCATIONS is not set
+DEFAULT_LOCATIONS = [
+    {
+        'slug': 'nelspruit',
+        'name': 'Nelspruit, Mpumalanga, South Africa',
+        'latitude': -25.4753,
+        'longitude': 30.9698,
+        'timezone': 'Africa/Johannesburg'
+    }
+]
+
+
+def load_locations() -> List[Dict]:
+    """Read the location registry from WEATHER_LOCATIONS (a JSON list of locations)"""
+    raw = os.environ.get('WEATHER_LOCATIONS')
+    if not raw:
+        return DEFAULT_LOCATIONS
+    locations = json.loads(raw)
+    for location in locations:
+        missing = {'slug', 'name', 'latitude', 'longitude'} - set(location)
+        if missing:
+            raise ValueError(f"Location {location} is missing {sorted(missing)}")
+        location.setdefault('timezone', 'Africa/Johannesburg')
+    return locations
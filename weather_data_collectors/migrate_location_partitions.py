@@ -0,0 +1,131 @@
+"""Moves weather objects written before the location partition into it.
+
+The collectors used to write historical/year=/month= and
+current/year=/month=/day=/hour= for the single hard-coded Nelspruit site.
+They now write historical/location=<slug>/... and current/location=<slug>/...,
+so older objects would be skipped by the historical manifest rebuild and the
+hourly window check, and refetched. This copies each legacy object under
+location=<slug>, deletes the original and rewrites legacy historical manifest
+entries to match. An object already present under the new key was written by
+the new collectors and is kept; the legacy copy is only deleted.
+
+Run once per bucket, before or right after deploying the collectors; it is
+safe to re-run. Without --apply it only reports what would move:
+
+    WEATHER_BUCKET=<bucket> python migrate_location_partitions.py [--apply]
+"""
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from aws_clients import get_client
+from locations import DEFAULT_LOCATIONS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Datasets partitioned by location, and where their legacy layout starts
+LEGACY_PREFIXES = ('historical/year=', 'current/year=')
+MANIFEST_KEY = 'manifests/historical_manifest.json'
+
+# The only site collected before the location registry existed
+LEGACY_SLUG = DEFAULT_LOCATIONS[0]['slug']
+
+
+def migrated_key(key: str, slug: str = LEGACY_SLUG) -> Optional[str]:
+    """Key of a legacy object under location=<slug>, or None if it is not in the legacy layout"""
+    dataset, sep, rest = key.partition('/')
+    if not sep or not key.startswith(LEGACY_PREFIXES):
+        return None
+    return f"{dataset}/location={slug}/{rest}"
+
+
+def migrate_manifest(manifest: Dict, slug: str = LEGACY_SLUG) -> Dict:
+    """Rewrite legacy "YYYY-MM" entries as "<slug>/YYYY-MM" pointing at the migrated keys
+    
+    Entries the new collector already wrote for the same month win.
+    """
+    migrated = {name: entry for name, entry in manifest.items() if '/' in name}
+    for name, entry in manifest.items():
+        if '/' in name:
+            continue
+        entry = dict(entry, key=migrated_key(entry.get('key', ''), slug) or entry.get('key'))
+        migrated.setdefault(f"{slug}/{name}", entry)
+    return migrated
+
+
+def migrate(s3_client, bucket: str, slug: str = LEGACY_SLUG, apply: bool = False, max_workers: int = 16) -> Dict:
+    """Move every legacy object of bucket under location=<slug>; dry run unless apply"""
+    counts = {'copied': 0, 'already_migrated': 0, 'deleted': 0, 'manifest_entries': 0}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    
+    def move(key: str) -> str:
+        target = migrated_key(key, slug)
+        try:
+            s3_client.head_object(Bucket=bucket, Key=target)
+            outcome = 'already_migrated'
+        except s3_client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            outcome = 'copied'
+            if apply:
+                s3_client.copy_object(Bucket=bucket, Key=target, CopySource={'Bucket': bucket, 'Key': key})
+        return outcome
+    
+    for prefix in LEGACY_PREFIXES:
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            keys = [obj['Key'] for obj in page.get('Contents', [])]
+            if not keys:
+                continue
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for outcome in executor.map(move, keys):
+                    counts[outcome] += 1
+            # A listing page holds at most 1000 keys, the delete_objects limit
+            if apply:
+                response = s3_client.delete_objects(
+                    Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+                )
+                if response.get('Errors'):
+                    raise RuntimeError(f"Could not delete legacy objects: {response['Errors'][:5]}")
+            counts['deleted'] += len(keys)
+    
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=MANIFEST_KEY)
+        manifest = json.loads(response['Body'].read())
+    except s3_client.exceptions.NoSuchKey:
+        manifest = {}
+    counts['manifest_entries'] = sum(1 for name in manifest if '/' not in name)
+    if apply and counts['manifest_entries']:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=MANIFEST_KEY,
+            Body=json.dumps(migrate_manifest(manifest, slug), indent=2, sort_keys=True),
+            ContentType='application/json'
+        )
+    
+    return counts
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--bucket', default=os.environ.get('WEATHER_BUCKET'))
+    arg_parser.add_argument('--slug', default=LEGACY_SLUG, help='location the legacy objects belong to')
+    arg_parser.add_argument('--apply', action='store_true', help='move the objects instead of reporting them')
+    args = arg_parser.parse_args()
+    if not args.bucket:
+        arg_parser.error('--bucket or WEATHER_BUCKET is required')
+    
+    counts = migrate(get_client('s3'), args.bucket, args.slug, args.apply)
+    verb = 'Migrated' if args.apply else 'Would migrate'
+    logger.info(
+        f"{verb} s3://{args.bucket}: {counts['copied']} copied, {counts['already_migrated']} already under "
+        f"location={args.slug}, {counts['deleted']} legacy objects deleted, "
+        f"{counts['manifest_entries']} manifest entries rewritten"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import io
+import json
+import os
+import sys
+import types
+
+import pytest
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from migrate_location_partitions import MANIFEST_KEY, migrate, migrated_key  # noqa: E402
+
+
+class MemoryS3:
+    """The S3 calls the migration makes, over a dict of key -> body"""
+
+    exceptions = types.SimpleNamespace(ClientError=ClientError, NoSuchKey=type('NoSuchKey', (Exception,), {}))
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        # Small pages so the per-page copy and delete runs more than once
+        return [{'Contents': [{'Key': key} for key in keys[i:i + 2]]} for i in range(0, len(keys), 2)]
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            self.objects.pop(obj['Key'], None)
+        return {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'Body': io.BytesIO(self.objects[Key].encode())}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+
+LEGACY = {
+    'historical/year=2024/month=01/weather_data.json': 'jan',
+    'historical/year=2024/month=02/weather_data.json': 'feb',
+    'current/year=2024/month=02/day=03/hour=04/weather_data.json': 'hour',
+    # Already rewritten by the new collector, so it is kept over the legacy object
+    'historical/location=nelspruit/year=2024/month=02/weather_data.json': 'feb-new',
+    'historical/location=other/year=2024/month=01/weather_data.json': 'other',
+    MANIFEST_KEY: json.dumps({
+        '2024-01': {'key': 'historical/year=2024/month=01/weather_data.json', 'day_count': 31},
+        '2024-02': {'key': 'historical/year=2024/month=02/weather_data.json', 'day_count': 29},
+        'nelspruit/2024-02': {'key': 'historical/location=nelspruit/year=2024/month=02/weather_data.json'}
+    })
+}
+
+
+def test_migrated_key():
+    assert migrated_key('historical/year=2024/month=01/weather_data.json') == \
+        'historical/location=nelspruit/year=2024/month=01/weather_data.json'
+    assert migrated_key('current/year=2024/month=02/day=03/hour=04/weather_data.parquet', 'site') == \
+        'current/location=site/year=2024/month=02/day=03/hour=04/weather_data.parquet'
+    assert migrated_key('historical/location=nelspruit/year=2024/month=01/weather_data.json') is None
+    assert migrated_key(MANIFEST_KEY) is None
+
+
+def test_dry_run_changes_nothing():
+    s3 = MemoryS3(LEGACY)
+    counts = migrate(s3, 'bucket')
+    assert s3.objects == LEGACY
+    assert counts == {'copied': 2, 'already_migrated': 1, 'deleted': 3, 'manifest_entries': 2}
+
+
+@pytest.mark.parametrize('runs', [1, 2])
+def test_apply_moves_legacy_objects(runs):
+    s3 = MemoryS3(LEGACY)
+    for _ in range(runs):
+        migrate(s3, 'bucket', apply=True)
+    manifest = json.loads(s3.objects.pop(MANIFEST_KEY))
+    assert s3.objects == {
+        'historical/location=nelspruit/year=2024/month=01/weather_data.json': 'jan',
+        'historical/location=nelspruit/year=2024/month=02/weather_data.json': 'feb-new',
+        'historical/location=other/year=2024/month=01/weather_data.json': 'other',
+        'current/location=nelspruit/year=2024/month=02/day=03/hour=04/weather_data.json': 'hour'
+    }
+    assert manifest == {
+        'nelspruit/2024-01': {
+            'key': 'historical/location=nelspruit/year=2024/month=01/weather_data.json', 'day_count': 31
+        },
+        'nelspruit/2024-02': {'key': 'historical/location=nelspruit/year=2024/month=02/weather_data.json'}
+    }